@@ -0,0 +1,375 @@
+"""Request-scoped memcache facade.
+
+Handlers open a scope per request (ContentHandler.dispatch does this). Within
+it, every key a request is going to read can be fetched up front with a single
+prefetch(), after which get() and get_or_compute() are served from the
+prefetched values:
+
+  cache.prefetch([toc_key, feed_key])  # One get_multi round trip.
+  toc = cache.get_or_compute(toc_key, build_toc, time=3600)
+
+Values stored with set() are written back with one set_multi per expiry time
+when the request ends, so a page that misses on several of them pays for one
+write round trip rather than one per key. Skeletons and cachefragment output
+are stored this way:
+
+  parts = cache.get(skeleton_key)
+  if parts is None:
+    parts = build_skeleton()
+    cache.set(skeleton_key, parts, 3600)  # Written back by end().
+
+set() snapshots the value the way memcache would store it, so changes callers
+make to it afterwards are not written back.
+
+Expensive values shared by many requests (TOCs, feeds, profiles, resource
+lists, API JSON) go through get_or_compute() instead, which makes sure only
+one caller recomputes an expired entry. It writes to memcache straight away,
+since other requests are waiting on the value and its lease.
+
+Outside a scope (e.g. at import time or in tasks) the module functions fall
+straight through to memcache.
+"""
+
+import cPickle
+import collections
+import logging
+import math
+import random
+import threading
+import time as _time
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+
+# How long a caller may hold the recompute lease for a key, in seconds.
+LEASE_TIME = 10
+
+# How long a deferred refresh holds the lease, which includes queueing time.
+REFRESH_LEASE_TIME = 60
+
+# How a caller that finds neither a value nor a free lease waits for the
+# lease holder before computing the value itself.
+WAIT_INTERVAL = 0.05
+WAIT_ATTEMPTS = 20
+
+# Scales how early entries get refreshed ahead of their expiry. See
+# get_or_compute().
+EARLY_REFRESH_BETA = 1.0
+
+_local = threading.local()
+
+
+class LocalCache(object):
+  """A bounded, thread-safe, in-process cache with per-entry expiry.
+
+  Entries live in the instance's memory, so they are dropped whenever the
+  app is redeployed. Once |max_size| entries are stored, the least recently
+  used ones are evicted.
+  """
+
+  def __init__(self, max_size, time):
+    self.max_size = max_size
+    self.time = time
+    self._entries = collections.OrderedDict()  # key -> (expires, value)
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None or entry[0] < _time.time():
+        self.misses += 1
+        return None
+      self._entries[key] = entry  # Mark as most recently used.
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (_time.time() + self.time, value)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    return {'size': len(self._entries), 'hits': self.hits,
+            'misses': self.misses}
+
+
+class SingleFlight(object):
+  """Coalesces identical concurrent computations within this instance.
+
+  The first caller for a key runs the computation; callers arriving while it
+  is in progress wait for it and share its result (or exception).
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._in_flight = {}  # key -> _Flight
+    self.calls = 0
+    self.collapsed = 0
+
+  def do(self, key, compute):
+    with self._lock:
+      self.calls += 1
+      flight = self._in_flight.get(key)
+      if flight is None:
+        flight = self._in_flight[key] = _Flight()
+        leader = True
+      else:
+        self.collapsed += 1
+        leader = False
+
+    if not leader:
+      flight.done.wait()
+      if flight.error is not None:
+        raise flight.error
+      return flight.result
+
+    try:
+      flight.result = compute()
+    except BaseException, e:
+      # Also covers e.g. DeadlineExceededError, which is not an Exception
+      # subclass, so that waiters re-raise it rather than return None.
+      flight.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._in_flight[key]
+      flight.done.set()
+    return flight.result
+
+  def stats(self):
+    return {
+      'calls': self.calls,
+      'collapsed': self.collapsed,
+      'collapse_rate': self.calls and float(self.collapsed) / self.calls,
+    }
+
+
+class _Flight(object):
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class RequestCache(object):
+  """Memcache values read and written during one request."""
+
+  def __init__(self):
+    self._values = {}  # Known values, None for known misses.
+    self._writes = {}  # Pending writes: {expiry time: {key: pickled value}}.
+
+  def prefetch(self, keys):
+    """Fetches all |keys| not yet known with one get_multi call."""
+    missing = [key for key in keys if key not in self._values]
+    if missing:
+      found = memcache.get_multi(missing)
+      for key in missing:
+        self._values[key] = found.get(key)
+
+  def get(self, key):
+    if key not in self._values:
+      self._values[key] = memcache.get(key)
+    return self._values[key]
+
+  def set(self, key, value, time=0):
+    # Pickle now, as memcache.set() would: the caller may keep mutating the
+    # value (e.g. localizing entities in place) before commit().
+    snapshot = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    self._values[key] = value
+    for mapping in self._writes.itervalues():
+      mapping.pop(key, None)
+    self._writes.setdefault(time, {})[key] = snapshot
+
+  def remember(self, key, value):
+    """Records a value that has already been written to memcache."""
+    self._values[key] = value
+
+  def invalidate(self, key):
+    """Forgets |key| so that the next get() goes back to memcache."""
+    self._values.pop(key, None)
+    for mapping in self._writes.itervalues():
+      mapping.pop(key, None)
+
+  def commit(self):
+    """Writes back every pending value, one set_multi per expiry time."""
+    for time, mapping in self._writes.iteritems():
+      if mapping:
+        values = dict((key, cPickle.loads(snapshot))
+                      for key, snapshot in mapping.iteritems())
+        memcache.set_multi(values, time=time)
+    self._writes = {}
+
+
+def begin():
+  """Opens a request scope on this thread."""
+  _local.cache = RequestCache()
+  return _local.cache
+
+
+def end():
+  """Closes this thread's request scope, writing back pending values."""
+  request_cache = getattr(_local, 'cache', None)
+  _local.cache = None
+  if request_cache is not None:
+    request_cache.commit()
+
+
+def current():
+  """Returns this thread's RequestCache, or None outside a request scope."""
+  return getattr(_local, 'cache', None)
+
+
+def prefetch(keys):
+  request_cache = current()
+  if request_cache is not None:
+    request_cache.prefetch(keys)
+
+
+def get(key):
+  request_cache = current()
+  if request_cache is None:
+    return memcache.get(key)
+  return request_cache.get(key)
+
+
+def set(key, value, time=0):
+  request_cache = current()
+  if request_cache is None:
+    memcache.set(key, value, time)
+  else:
+    request_cache.set(key, value, time)
+
+
+def flush_all():
+  """Flushes memcache along with anything this request read or queued."""
+  memcache.flush_all()
+  if current() is not None:
+    _local.cache = RequestCache()
+
+
+def invalidate(key):
+  request_cache = current()
+  if request_cache is not None:
+    request_cache.invalidate(key)
+
+
+class Entry(object):
+  """A value stored by get_or_compute(), with its expiry and compute time."""
+
+  def __init__(self, value, expires, delta):
+    self.value = value
+    self.expires = expires  # Absolute time, or None for no expiry.
+    self.delta = delta  # Seconds it took to compute the value.
+
+  def needs_refresh(self, now):
+    """Whether this caller should try to refresh the value.
+
+    Besides expired entries, this picks fresh entries with a probability that
+    grows as expiry approaches and with the cost of recomputing the value, so
+    that one caller usually refreshes it before it expires.
+    """
+    if self.expires is None:
+      return False
+    return (now - self.delta * EARLY_REFRESH_BETA *
+            math.log(1.0 - random.random())) >= self.expires
+
+
+def _lease_key(key):
+  return '%s|lease' % (key,)
+
+
+def _compute_and_store(key, compute, args, time, stale_time,
+                       release_lease=False):
+  """Computes and stores the entry for |key|.
+
+  |release_lease| says whether the caller holds the lease, which is then
+  given up. Callers that don't hold it must leave it to whoever does.
+  """
+  start = _time.time()
+  value = compute(*args)
+  now = _time.time()
+
+  entry = Entry(value, time and now + time or None, now - start)
+  memcache.set(key, entry, stale_time)
+  if release_lease:
+    memcache.delete(_lease_key(key))
+
+  request_cache = current()
+  if request_cache is not None:
+    request_cache.remember(key, entry)
+  return value
+
+
+def _refresh(key, compute, args, time, stale_time):
+  """Deferred task recomputing an entry served stale by get_or_compute()."""
+  # The lease was taken for this task by _defer_refresh().
+  _compute_and_store(key, compute, args, time, stale_time, release_lease=True)
+
+
+def _defer_refresh(key, compute, args, time, stale_time):
+  # Give the task queue time to pick the refresh up before anyone else tries.
+  memcache.set(_lease_key(key), 1, REFRESH_LEASE_TIME)
+  try:
+    deferred.defer(_refresh, key, compute, args, time, stale_time)
+  except Exception:
+    logging.exception('Could not defer a refresh of %s', key)
+    memcache.delete(_lease_key(key))
+
+
+def get_or_compute(key, compute, time=0, force=False, args=(),
+                   stale_time=None, refresh_in_background=False):
+  """Returns the value cached under |key|, recomputing it with compute(*args).
+
+  |time| is the soft TTL in seconds, 0 for none. Past it the value is stale
+  but still served until the hard TTL, |stale_time|, which defaults to twice
+  |time|. |force| recomputes the value unconditionally.
+
+  Concurrent callers on every instance are coalesced with a memcache add()
+  lease: only the caller holding the lease refreshes a stale value while the
+  others keep serving it. With |refresh_in_background| even the lease holder
+  serves the stale value and leaves the refresh to a deferred task, so no
+  request waits on it; |compute| and |args| must then be picklable, e.g. a
+  module-level function. When there is no value at all, e.g. after a
+  flush_all, callers without the lease wait briefly for the lease holder.
+  Values are also refreshed probabilistically shortly before they go stale.
+  """
+  if stale_time is None:
+    stale_time = time * 2
+
+  if force:
+    return _compute_and_store(key, compute, args, time, stale_time)
+
+  entry = get(key)
+  if isinstance(entry, Entry):
+    if not entry.needs_refresh(_time.time()):
+      return entry.value
+    if not memcache.add(_lease_key(key), 1, LEASE_TIME):
+      return entry.value  # Someone else is refreshing it.
+    if refresh_in_background:
+      _defer_refresh(key, compute, args, time, stale_time)
+      return entry.value
+    return _compute_and_store(key, compute, args, time, stale_time,
+                              release_lease=True)
+
+  if memcache.add(_lease_key(key), 1, LEASE_TIME):
+    return _compute_and_store(key, compute, args, time, stale_time,
+                              release_lease=True)
+
+  # add() also fails when memcache is unavailable, in which case there is no
+  # lease holder to wait for.
+  if memcache.get(_lease_key(key)) is not None:
+    for i in xrange(WAIT_ATTEMPTS):
+      _time.sleep(WAIT_INTERVAL)
+      entry = memcache.get(key)
+      if isinstance(entry, Entry):
+        return entry.value
+  return _compute_and_store(key, compute, args, time, stale_time)
@@ -0,0 +1,46 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Token handling shared by the custom template tags."""
+
+from django import template
+
+
+def consume_verbatim(tokens):
+  """Consumes |tokens| up to the next endverbatim and returns them as text.
+
+  Variable and block tokens are put back between their {{ }} and {% %}
+  delimiters. The tokens are scanned once and then removed from the list in
+  a single slice deletion, as popping them off its front one at a time is
+  quadratic in the number of tokens.
+  """
+  text = []
+  for i, token in enumerate(tokens):
+    if token.contents == 'endverbatim':
+      break
+    if token.token_type == template.TOKEN_VAR:
+      text.append('{{')
+    elif token.token_type == template.TOKEN_BLOCK:
+      text.append('{%')
+    text.append(token.contents)
+    if token.token_type == template.TOKEN_VAR:
+      text.append('}}')
+    elif token.token_type == template.TOKEN_BLOCK:
+      text.append('%}')
+  else:
+    raise template.TemplateSyntaxError('Unclosed tag verbatim. Looking for '
+                                       'endverbatim.')
+
+  del tokens[:i + 1]
+  return ''.join(text)
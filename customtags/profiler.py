@@ -0,0 +1,138 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in profiler for Django template rendering.
+
+install() wraps node and template rendering once per process. Rendering is
+only timed on threads that called start(), until they call stop():
+
+  profiler.start()
+  html = render_to_string('tutorial.html', data)
+  logging.info(profiler.stop().report())
+
+Times are recorded per template file and node type and include the time
+spent in nested nodes, so e.g. an IncludeNode's time covers the whole
+included template.
+"""
+
+import threading
+import time
+
+from django import template
+from django.template import debug
+
+_local = threading.local()
+
+# Number of threads currently profiling. Lets the wrappers skip the
+# thread-local lookup when nobody is profiling.
+_active = 0
+_active_lock = threading.Lock()
+
+_installed = False
+
+
+class Profile(object):
+  """Render times collected on one thread."""
+
+  def __init__(self):
+    self.templates = []  # Names of the templates being rendered.
+    self.stats = {}  # (template name, node type) -> [calls, seconds]
+
+  def add(self, node_type, seconds):
+    name = self.templates and self.templates[-1] or '<unknown>'
+    stat = self.stats.setdefault((name, node_type), [0, 0.0])
+    stat[0] += 1
+    stat[1] += seconds
+
+  def report(self, limit=50):
+    """Returns the |limit| most expensive entries as text, slowest first."""
+    lines = ['%10s %7s  %s' % ('ms', 'calls', 'template: node')]
+    entries = sorted(self.stats.iteritems(), key=lambda item: item[1][1],
+                     reverse=True)
+    for (name, node_type), (calls, seconds) in entries[:limit]:
+      lines.append('%10.2f %7d  %s: %s' % (seconds * 1000, calls, name,
+                                          node_type))
+    return '\n'.join(lines)
+
+
+def start():
+  """Starts profiling template rendering on this thread."""
+  global _active
+
+  install()
+  if getattr(_local, 'profile', None) is None:
+    with _active_lock:
+      _active += 1
+  _local.profile = Profile()
+  return _local.profile
+
+
+def stop():
+  """Stops profiling on this thread and returns the Profile, if any."""
+  global _active
+
+  profile = getattr(_local, 'profile', None)
+  if profile is not None:
+    _local.profile = None
+    with _active_lock:
+      _active -= 1
+  return profile
+
+
+def current():
+  """Returns the Profile being collected on this thread, or None."""
+  return _active and getattr(_local, 'profile', None) or None
+
+
+def _wrap_render_node(render_node):
+  def profiled_render_node(self, node, context):
+    profile = _active and getattr(_local, 'profile', None)
+    if not profile:
+      return render_node(self, node, context)
+    start = time.time()
+    try:
+      return render_node(self, node, context)
+    finally:
+      profile.add(node.__class__.__name__, time.time() - start)
+  return profiled_render_node
+
+
+def _wrap_template_render(render):
+  def profiled_render(self, context):
+    profile = _active and getattr(_local, 'profile', None)
+    if not profile:
+      return render(self, context)
+    profile.templates.append(getattr(self, 'name', None) or '<string>')
+    start = time.time()
+    try:
+      return render(self, context)
+    finally:
+      profile.add('Template', time.time() - start)
+      profile.templates.pop()
+  return profiled_render
+
+
+def install():
+  """Wraps Django's rendering methods. Safe to call more than once."""
+  global _installed
+
+  with _active_lock:
+    if _installed:
+      return
+    # DebugNodeList, used when TEMPLATE_DEBUG is on, has its own render_node.
+    for cls in (template.NodeList, debug.DebugNodeList):
+      if 'render_node' in cls.__dict__:
+        cls.render_node = _wrap_render_node(cls.__dict__['render_node'])
+    template.Template.render = _wrap_template_render(template.Template.render)
+    _installed = True
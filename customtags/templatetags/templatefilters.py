@@ -12,32 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import time
+import hashlib
+import os
 
 from django import template
+from django.conf import settings
+
+import cache
+import models
+from customtags.parsing import consume_verbatim
 
 register = template.Library()
 
+# Rendered {% cachefragment %} output, in front of memcache. Keys include the
+# deploy version, so entries never go stale.
+FRAGMENTS = cache.LocalCache(max_size=200, time=86400)
+FRAGMENT_TTL = 86400
+
 
 class TOCNode(template.Node):
   def render(self, context):
-    if not context.has_key('toc'):
+    # The markup is built along with the TOC, see main.build_toc().
+    if not context.get('toc'):
       return ''
-    toc = context['toc']
-    output = ''
-    level = 0
-    for entry in toc:
-      if entry['level'] > level:
-        output += "<ul>"
-      elif entry['level'] < level:
-        output += "</ul></li>" * (level - entry['level'])
-      else:
-        output += "</li>"
-      level = entry['level']
-      output += "<li><a href='#%s' onclick='$.scrollTo(\"#%s\", 800, {offset: {top: -35}})'>%s</a>" % (entry['id'], entry['id'], entry.get('text', ''))
-
-    output += "</li></ul>" * level
-    return output
+    return context['toc']['html']
 
 
 @register.tag(name='toc')
@@ -47,14 +45,23 @@ def do_toc(parser, token):
 
 class ProfileLink(template.Node):
   def __init__(self, ids):
-    self.ids = ids
-    self.profiles = []
+    self.ids = tuple(ids)
 
   def render(self, context):
+    # Bylines only change along with the profiles, so each one is rendered
+    # once per data generation.
+    registry = models.get_profile_registry()
+    key = (self.__class__.__name__, self.ids)
+    byline = registry.bylines.get(key)
+    if byline is None:
+      byline = registry.bylines[key] = self.render_byline(registry.profiles)
+    return byline
+
+  def render_byline(self, profiles):
     names = []
     for id in self.ids:
-      if id in self.profiles:
-        profile = self.profiles[id]
+      if id in profiles:
+        profile = profiles[id]
         names.append("<a href='/profiles/#%(id)s'>%(given)s %(family)s</a> <span>%(role)s, %(company)s</span>" %
             {'id': profile['id'], 'given': profile['given_name'],
              'family': profile['family_name'], 'role': profile['unit'],
@@ -73,11 +80,11 @@ class ProfileLinkSimple(ProfileLink):
   def __init__(self, ids):
     ProfileLink.__init__(self, ids)
 
-  def render(self, context):
+  def render_byline(self, profiles):
     names = []
     for id in self.ids:
-      if id in self.profiles:
-        profile = self.profiles[id]
+      if id in profiles:
+        profile = profiles[id]
         names.append("<a href='/profiles/#%(id)s' data-id='%(id)s'>%(given)s %(family)s</a>" %
             {'id': profile['id'],
              'given': profile['given_name'],
@@ -92,9 +99,26 @@ def do_simple_profile_link(parser, token):
   return ProfileLinkSimple(ids)
 
 
-class MixinAnnotation(template.Node):
+class ConstantNode(template.Node):
+  """A node whose output only depends on its tag's arguments.
+
+  |render_output| is called once, without arguments, when the node is
+  created at parse time. render() returns the string it returned.
+  """
+
+  def __init__(self, render_output):
+    self.output = render_output()
+
+  def render(self, context):
+    return self.output
+
+
+class MixinAnnotation(ConstantNode):
 
-  def __init__(self, props):
+  PREFIXES = ['-webkit', '   -moz', '    -ms', '     -o']
+  URL = 'http://sass-lang.com/docs/yardoc/file.SASS_REFERENCE.html#including_a_mixin'
+
+  def __init__(self, props, tooltip_id):
     self.prop = props[0]
     self.val = ' '.join(props[1:])
     if self.prop[-1] != ':':
@@ -106,29 +130,87 @@ class MixinAnnotation(template.Node):
         self.val = props[0][idx:] + ' ' + self.val
     if self.val[-1] != ';':
       self.val += ';'
+    self.tooltip_id = tooltip_id
+    ConstantNode.__init__(self, self.render_annotation)
 
-  def render(self, context):
-    PREFIXES = ['-webkit', '   -moz', '    -ms', '     -o']
+  def render_annotation(self):
     prefix_list = '\n'.join(
-        ['%s-%s ...' % (x, self.prop) for x in PREFIXES])
+        ['%s-%s ...' % (x, self.prop) for x in self.PREFIXES])
     prefix_list += '\n        %s ...' % (self.prop) # Include unprefixed version.
     prefix_list = '/*Vendor prefixes required. Try Compass/SASS.*/\n' + prefix_list
 
-    url = 'http://sass-lang.com/docs/yardoc/file.SASS_REFERENCE.html#including_a_mixin'
-
-    tooltip_id = 'tooltip' + str(time.clock())
-
     return ('<a href="%s" id="%s" target="_blank" data-tooltip="%s" role="tooltip" '
             'aria-describedby="%s" class="noexternal tooltip">+'
-            '<span class="property">%s</span> %s</a>' % (url, tooltip_id,
-                                                         prefix_list, tooltip_id,
+            '<span class="property">%s</span> %s</a>' % (self.URL, self.tooltip_id,
+                                                         prefix_list, self.tooltip_id,
                                                          self.prop, self.val))
 
 @register.tag(name='mixin')
 def do_mixin_annotation(parser, token):
   props = token.split_contents()
   props.pop(0)  # Remove tag name
-  return MixinAnnotation(props)
+
+  # Ids are derived from the arguments and the tag's position among the
+  # template's mixins, so they are unique within a page and stable across
+  # renders.
+  parser.mixin_count = getattr(parser, 'mixin_count', 0) + 1
+  tooltip_id = 'tooltip-%s-%d' % (
+      hashlib.md5(' '.join(props).encode('utf-8')).hexdigest()[:8],
+      parser.mixin_count)
+  return MixinAnnotation(props, tooltip_id)
+
+
+class CacheFragmentNode(template.Node):
+
+  def __init__(self, nodelist, name, vary_on):
+    self.nodelist = nodelist
+    self.name = name
+    self.vary_on = [template.Variable(v) for v in vary_on]
+
+  def key(self, context):
+    vary_values = []
+    for var in self.vary_on:
+      try:
+        vary_values.append(unicode(var.resolve(context)))
+      except template.VariableDoesNotExist:
+        vary_values.append(u'')
+    vary_hash = hashlib.md5(u'|'.join(vary_values).encode('utf-8')).hexdigest()
+    return '%s|fragment|%s|%s|%s' % (settings.MEMCACHE_KEY_PREFIX,
+                                     os.environ.get('CURRENT_VERSION_ID', ''),
+                                     self.name, vary_hash)
+
+  def render(self, context):
+    # Render every time on the dev server, so template edits show up.
+    if settings.TEMPLATE_DEBUG:
+      return self.nodelist.render(context)
+
+    key = self.key(context)
+    output = FRAGMENTS.get(key)
+    if output is None:
+      output = cache.get(key)
+      if output is None:
+        output = self.nodelist.render(context)
+        cache.set(key, output, FRAGMENT_TTL)
+      FRAGMENTS.set(key, output)
+    return output
+
+
+@register.tag(name='cachefragment')
+def do_cache_fragment(parser, token):
+  """Caches the rendered contents of the block per deploy.
+
+  Usage: {% cachefragment name [vary_on ...] %}...{% endcachefragment %}
+
+  The contents are rendered once for every combination of values of the
+  vary_on variables, so they must not depend on anything else.
+  """
+  bits = token.split_contents()
+  if len(bits) < 2:
+    raise template.TemplateSyntaxError(
+        "'%s' tag requires a fragment name." % bits[0])
+  nodelist = parser.parse(('endcachefragment',))
+  parser.delete_first_token()
+  return CacheFragmentNode(nodelist, bits[1].strip('\'"'), bits[2:])
 
 
 """
@@ -155,19 +237,4 @@ class VerbatimNode(template.Node):
 
 @register.tag
 def verbatim(parser, token):
-  text = []
-  while 1:
-    token = parser.tokens.pop(0)
-    if token.contents == 'endverbatim':
-      break
-    if token.token_type == template.TOKEN_VAR:
-      text.append('{{')
-    elif token.token_type == template.TOKEN_BLOCK:
-      text.append('{%')
-    text.append(token.contents)
-    if token.token_type == template.TOKEN_VAR:
-      text.append('}}')
-    elif token.token_type == template.TOKEN_BLOCK:
-      text.append('%}')
-
-  return VerbatimNode(''.join(text))
+  return VerbatimNode(consume_verbatim(parser.tokens))
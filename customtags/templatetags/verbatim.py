@@ -1,44 +1,17 @@
 """
-jQuery templates use constructs like:
-
-    {{if condition}} print something{{/if}}
-
-This, of course, completely screws up Django templates,
-because Django thinks {{ and }} mean something.
-
-Wrap {% verbatim %} and {% endverbatim %} around those
-blocks of jQuery templates and this will try its best
-to output the contents with no changes.
+{% load verbatim %} is kept working for templates that use it. It only
+provides the verbatim tag, which shares its implementation with the one in
+templatefilters.
 """
 
 from django import template
 
-register = template.Library()
+from customtags.parsing import consume_verbatim
+from customtags.templatetags.templatefilters import VerbatimNode
 
-
-class VerbatimNode(template.Node):
-
-    def __init__(self, text):
-        self.text = text
-    
-    def render(self, context):
-        return self.text
+register = template.Library()
 
 
 @register.tag
 def verbatim(parser, token):
-    text = []
-    while 1:
-        token = parser.tokens.pop(0)
-        if token.contents == 'endverbatim':
-            break
-        if token.token_type == template.TOKEN_VAR:
-            text.append('{{')
-        elif token.token_type == template.TOKEN_BLOCK:
-            text.append('{%')
-        text.append(token.contents)
-        if token.token_type == template.TOKEN_VAR:
-            text.append('}}')
-        elif token.token_type == template.TOKEN_BLOCK:
-            text.append('%}')
-    return VerbatimNode(''.join(text))
\ No newline at end of file
+    return VerbatimNode(consume_verbatim(parser.tokens))
@@ -0,0 +1,40 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Markup of the article tables of contents served by {% toc %}."""
+
+ENTRY_TEMPLATE = ("<li><a href='#%s' onclick='$.scrollTo(\"#%s\", 800, "
+                  "{offset: {top: -35}})'>%s</a>")
+
+
+def render_toc(toc):
+  """Returns the nested <ul> markup of a list of TOC entries.
+
+  Entries are dicts with the heading's 'level' (1 for h2), 'id' and 'text'.
+  """
+  parts = []
+  level = 0
+  for entry in toc:
+    if entry['level'] > level:
+      parts.append("<ul>")
+    elif entry['level'] < level:
+      parts.append("</ul></li>" * (level - entry['level']))
+    else:
+      parts.append("</li>")
+    level = entry['level']
+    parts.append(ENTRY_TEMPLATE % (entry['id'], entry['id'],
+                                   entry.get('text', '')))
+
+  parts.append("</li></ul>" * level)
+  return ''.join(parts)
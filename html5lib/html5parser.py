@@ -49,10 +49,14 @@ class HTMLParser(object):
 
     def __init__(self, tree = simpletree.TreeBuilder,
                  tokenizer = tokenizer.HTMLTokenizer, strict = False,
-                 namespaceHTMLElements = True):
+                 namespaceHTMLElements = True, collectErrors = True):
         """
         strict - raise an exception when a parse error is encountered
 
+        collectErrors - record parse errors and their positions in
+        self.errors. When False, errors are dropped and the input is not
+        scanned for invalid characters, which makes parsing faster.
+
         tree - a treebuilder class controlling the type of tree that will be
         returned. Built in treebuilders can be accessed through
         html5lib.treebuilders.getTreeBuilder(treeType)
@@ -64,6 +68,7 @@ class HTMLParser(object):
 
         # Raise an exception on the first error encountered
         self.strict = strict
+        self.collectErrors = collectErrors
 
         self.tree = tree(namespaceHTMLElements)
         self.tokenizer_class = tokenizer
@@ -101,6 +106,8 @@ class HTMLParser(object):
 
         self.innerHTMLMode = innerHTML
         self.container = container
+        if not self.collectErrors:
+            kwargs["characterErrors"] = False
         self.tokenizer = self.tokenizer_class(stream, encoding=encoding,
                                               parseMeta=parseMeta,
                                               useChardet=useChardet, **kwargs)
@@ -230,7 +237,9 @@ class HTMLParser(object):
 
     def parseError(self, errorcode="XXX-undefined-error", datavars={}):
         # XXX The idea is to make errorcode mandatory.
-        self.errors.append((self.tokenizer.stream.position(), errorcode, datavars))
+        if self.collectErrors:
+            self.errors.append((self.tokenizer.stream.position(), errorcode,
+                                datavars))
         if self.strict:
             raise ParseError
 
@@ -113,7 +113,8 @@ class HTMLInputStream:
 
     _defaultChunkSize = 10240
 
-    def __init__(self, source, encoding=None, parseMeta=True, chardet=True):
+    def __init__(self, source, encoding=None, parseMeta=True, chardet=True,
+                 characterErrors=True):
         """Initialises the HTMLInputStream.
 
         HTMLInputStream(source, [encoding]) -> Normalized stream from source
@@ -128,10 +129,15 @@ class HTMLInputStream:
         
         parseMeta - Look for a <meta> element containing encoding information
 
+        characterErrors - Report NULs and invalid codepoints in self.errors.
+        Scanning for them is skipped entirely if this is False.
+
         """
 
         #Craziness
-        if len(u"\U0010FFFF") == 1:
+        if not characterErrors:
+            self.reportCharacterErrors = self.characterErrorsIgnored
+        elif len(u"\U0010FFFF") == 1:
             self.reportCharacterErrors = self.characterErrorsUCS4
         else:
             self.reportCharacterErrors = self.characterErrorsUCS2
@@ -141,8 +147,14 @@ class HTMLInputStream:
 
         self.charEncoding = (codecName(encoding), "certain")
 
-        # Raw Stream - for unicode objects this will encode to utf-8 and set
-        #              self.charEncoding as appropriate
+        # Strings are held in memory and served to the tokenizer as a single
+        # chunk. Unicode strings need no decoding at all, so they are kept
+        # in self.unicodeSource and have no raw stream.
+        self.inMemory = not hasattr(source, 'read')
+        self.unicodeSource = None
+
+        # Raw Stream - for unicode objects this is None and self.charEncoding
+        #              is set as appropriate
         self.rawStream = self.openStream(source)
 
         # Encoding Information
@@ -162,13 +174,11 @@ class HTMLInputStream:
         self.reset()
 
     def reset(self):
-        self.dataStream = codecs.getreader(self.charEncoding[0])(self.rawStream,
-                                                                 'replace')
-
         self.chunk = u""
         self.chunkSize = 0
         self.chunkOffset = 0
         self.errors = []
+        self._resetPosition()
 
         # number of (complete) lines in previous chunks
         self.prevNumLines = 0
@@ -178,10 +188,32 @@ class HTMLInputStream:
         #Flag to indicate we may have a CR LF broken across a data chunk
         self._lastChunkEndsWithCR = False
 
+        if self.inMemory:
+            # Decode everything at once and make it the only chunk, so that
+            # char() and charsUntil() never have to read another one
+            self.dataStream = None
+            if self.unicodeSource is not None:
+                data = self.unicodeSource
+            else:
+                data = codecs.getreader(self.charEncoding[0])(self.rawStream,
+                                                              'replace').read()
+            self.reportCharacterErrors(data)
+            if u"\u0000" in data:
+                data = data.replace(u"\u0000", u"\ufffd")
+            if u"\r" in data:
+                data = data.replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+            self.chunk = data
+            self.chunkSize = len(data)
+        else:
+            self.dataStream = codecs.getreader(self.charEncoding[0])(
+                self.rawStream, 'replace')
+
     def openStream(self, source):
         """Produces a file object from source.
 
         source can be either a file object, local filename or a string.
+        Unicode strings need no file object: they are kept in
+        self.unicodeSource and None is returned.
 
         """
         # Already a file object
@@ -190,8 +222,9 @@ class HTMLInputStream:
         else:
             # Otherwise treat source as a string and convert to a file object
             if isinstance(source, unicode):
-                source = source.encode('utf-8')
+                self.unicodeSource = source
                 self.charEncoding = ("utf-8", "certain")
+                return None
             import cStringIO
             stream = cStringIO.StringIO(str(source))
 
@@ -299,11 +332,28 @@ class HTMLInputStream:
 
         return encoding
 
+    def _resetPosition(self):
+        """Forgets the last position computed, e.g. when the chunk changes"""
+        # (offset, newlines before offset, offset of the last of them or -1)
+        self._lastPosition = (0, 0, -1)
+
     def _position(self, offset):
         chunk = self.chunk
-        nLines = chunk.count(u'\n', 0, offset)
+        # Positions are mostly asked for in increasing order, so count on
+        # from the last one computed rather than from the start of the chunk
+        lastOffset, nLines, lastLinePos = self._lastPosition
+        if offset >= lastOffset:
+            nLines += chunk.count(u'\n', lastOffset, offset)
+            lastLinePos = max(lastLinePos,
+                              chunk.rfind(u'\n', lastOffset, offset))
+        else:
+            # Moved back, e.g. after an unget()
+            nLines -= chunk.count(u'\n', offset, lastOffset)
+            if lastLinePos >= offset:
+                lastLinePos = chunk.rfind(u'\n', 0, offset)
+        self._lastPosition = (offset, nLines, lastLinePos)
+
         positionLine = self.prevNumLines + nLines
-        lastLinePos = chunk.rfind(u'\n', 0, offset)
         if lastLinePos == -1:
             positionColumn = self.prevNumCols + offset
         else:
@@ -339,6 +389,11 @@ class HTMLInputStream:
         self.chunk = u""
         self.chunkSize = 0
         self.chunkOffset = 0
+        self._resetPosition()
+
+        if self.dataStream is None:
+            # In-memory sources are read as a single chunk by reset()
+            return False
 
         data = self.dataStream.read(chunkSize)
 
@@ -369,6 +424,9 @@ class HTMLInputStream:
         for i in xrange(len(invalid_unicode_re.findall(data))):
             self.errors.append("invalid-codepoint")
 
+    def characterErrorsIgnored(self, data):
+        pass
+
     def characterErrorsUCS2(self, data):
         #Someone picked the wrong compile option
         #You lose
@@ -421,6 +479,19 @@ class HTMLInputStream:
                 regex = u"^%s" % regex
             chars = charsUntilRegEx[(characters, opposite)] = re.compile(u"[%s]+" % regex)
 
+        # Most runs end within the current chunk, so handle those without
+        # building up a list of parts
+        chunkOffset = self.chunkOffset
+        m = chars.match(self.chunk, chunkOffset)
+        if m is None:
+            if chunkOffset != self.chunkSize:
+                return u""
+        else:
+            end = m.end()
+            if end != self.chunkSize:
+                self.chunkOffset = end
+                return self.chunk[chunkOffset:end]
+
         rv = []
 
         while True:
@@ -476,6 +547,7 @@ class HTMLInputStream:
                 # chunk:
                 self.chunk = char + self.chunk
                 self.chunkSize += 1
+                self._resetPosition()
             else:
                 self.chunkOffset -= 1
                 assert self.chunk[self.chunkOffset] == char
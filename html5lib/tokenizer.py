@@ -18,10 +18,25 @@ from constants import replacementCharacters
 
 from inputstream import HTMLInputStream
 
-# Group entities by their first character, for faster lookups
-entitiesByFirstChar = {}
+# Trie of the entity names, so that consumeEntity can match them one
+# character at a time. Each node maps a character to the next node, and the
+# node reached by a whole name also maps u"" (which is never a character read
+# from the stream) to that name.
+entitiesTrie = {}
 for e in entities:
-    entitiesByFirstChar.setdefault(e[0], []).append(e)
+    node = entitiesTrie
+    for c in e:
+        node = node.setdefault(c, {})
+    node[u""] = e
+
+# Characters ending the runs that the tag name and attribute states consume
+# with a single charsUntil call rather than one character per state change
+tagNameEndCharacters = spaceCharacters | frozenset((u"/", u">"))
+attributeNameEndCharacters = spaceCharacters | frozenset((u"=", u">", u"/",
+                                                          u"'", u'"', u"<"))
+unquotedAttributeValueEndCharacters = spaceCharacters | frozenset(
+    (u"&", u">", u'"', u"'", u"=", u"<", u"`"))
+scriptDataDoubleEscapeEndCharacters = spaceCharacters | frozenset((u"/", u">"))
 
 class HTMLTokenizer:
     """ This class takes care of tokenizing HTML.
@@ -39,9 +54,11 @@ class HTMLTokenizer:
     # XXX need to fix documentation
 
     def __init__(self, stream, encoding=None, parseMeta=True, useChardet=True,
-                 lowercaseElementName=True, lowercaseAttrName=True):
+                 lowercaseElementName=True, lowercaseAttrName=True,
+                 characterErrors=True):
 
-        self.stream = HTMLInputStream(stream, encoding, parseMeta, useChardet)
+        self.stream = HTMLInputStream(stream, encoding, parseMeta, useChardet,
+                                      characterErrors)
         
         #Perform case conversions?
         self.lowercaseElementName = lowercaseElementName
@@ -174,31 +191,19 @@ class HTMLTokenizer:
                 output = u"&" + u"".join(charStack)
 
         else:
-            # At this point in the process might have named entity. Entities
-            # are stored in the global variable "entities".
-            #
-            # Consume characters and compare to these to a substring of the
-            # entity names in the list until the substring no longer matches.
-            filteredEntityList = entitiesByFirstChar.get(charStack[0], [])
-
-            def entitiesStartingWith(name):
-                return [e for e in filteredEntityList if e.startswith(name)]
-
-            while charStack[-1] is not EOF and\
-              entitiesStartingWith("".join(charStack)):
-                charStack.append(self.stream.char())
-
-            # At this point we have a string that starts with some characters
-            # that may match an entity
+            # At this point in the process might have named entity. Walk the
+            # entity trie, consuming characters until they no longer lead to
+            # any entity name, and remember the longest name passed on the
+            # way to take care of &noti for instance. The last character in
+            # charStack is then the one that matched nothing (or EOF).
             entityName = None
-
-            # Try to find the longest entity the string will match to take care
-            # of &noti for instance.
-            for entityLength in xrange(len(charStack)-1, 1, -1):
-                possibleEntityName = "".join(charStack[:entityLength])
-                if possibleEntityName in entities:
-                    entityName = possibleEntityName
-                    break
+            node = entitiesTrie.get(charStack[0])
+            while node is not None:
+                if u"" in node:
+                    entityName = node[u""]
+                    entityLength = len(charStack)
+                charStack.append(self.stream.char())
+                node = node.get(charStack[-1])
 
             if entityName is not None:
                 if entityName[-1] != ";":
@@ -418,9 +423,8 @@ class HTMLTokenizer:
         elif data == u"/":
             self.state = self.selfClosingStartTagState
         else:
-            self.currentToken["name"] += data
-            # (Don't use charsUntil here, because tag names are
-            # very short and it's faster to not do anything fancy)
+            self.currentToken["name"] += data +\
+              self.stream.charsUntil(tagNameEndCharacters)
         return True
     
     def rcdataLessThanSignState(self):
@@ -697,7 +701,7 @@ class HTMLTokenizer:
     
     def scriptDataDoubleEscapeStartState(self):
         data = self.stream.char()
-        if data in (spaceCharacters | frozenset(("/", ">"))):
+        if data in scriptDataDoubleEscapeEndCharacters:
             self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
             if self.temporaryBuffer.lower() == "script":
                 self.state = self.scriptDataDoubleEscapedState
@@ -776,7 +780,7 @@ class HTMLTokenizer:
     
     def scriptDataDoubleEscapeEndState(self):
         data = self.stream.char()
-        if data in (spaceCharacters | frozenset(("/", ">"))):
+        if data in scriptDataDoubleEscapeEndCharacters:
             self.tokenQueue.append({"type": tokenTypes["Characters"], "data": data})
             if self.temporaryBuffer.lower() == "script":
                 self.state = self.scriptDataEscapedState
@@ -823,7 +827,7 @@ class HTMLTokenizer:
             self.state = self.beforeAttributeValueState
         elif data in asciiLetters:
             self.currentToken["data"][-1][0] += data +\
-              self.stream.charsUntil(asciiLetters, True)
+              self.stream.charsUntil(attributeNameEndCharacters)
             leavingThisState = False
         elif data == u">":
             # XXX If we emit here the attributes are converted to a dict
@@ -845,7 +849,8 @@ class HTMLTokenizer:
             self.state = self.dataState
             emitToken = True
         else:
-            self.currentToken["data"][-1][0] += data
+            self.currentToken["data"][-1][0] += data +\
+              self.stream.charsUntil(attributeNameEndCharacters)
             leavingThisState = False
 
         if leavingThisState:
@@ -969,7 +974,7 @@ class HTMLTokenizer:
             self.emitCurrentToken()
         else:
             self.currentToken["data"][-1][1] += data + self.stream.charsUntil(
-              frozenset((u"&", u">", u'"', u"'", u"=", u"<", u"`")) | spaceCharacters)
+              unquotedAttributeValueEndCharacters)
         return True
 
     def afterAttributeValueState(self):
@@ -17,42 +17,285 @@
 __author__ = 'ericbidelman@html5rocks.com (Eric Bidelman)'
 
 # Standard Imports
+import base64
 import datetime
 import glob
+import hashlib
 import logging
 import os
 import re
+import urllib
 import urllib2
 import webapp2
 import yaml
 
 # App libs.
+import cache
 import settings
 import models
+import search
 
 # Libraries
 import html5lib
+from customtags import profiler
+from customtags.toc import render_toc
 from html5lib import treebuilders, treewalkers
 
 from django.template.loader import render_to_string
 from django.utils import feedgenerator
 from django.utils import simplejson
 from django.utils import translation
+from django.utils.html import conditional_escape
+from django.utils.translation import trans_real
 from django.utils.translation import ugettext as _
 
 # Google App Engine Imports
 #from google.appengine.api import datastore_errors
-from google.appengine.api import memcache
 from google.appengine.api import users
 from google.appengine.ext import db
 
 
+# Compact, reusable encoder for API responses. Output is serialized once per
+# data generation and served from memcache afterwards.
+_json_encoder = simplejson.JSONEncoder(separators=(',', ':'))
+
+
+def load_catalogs():
+  """Returns the gettext catalog of every locale under LOCALE_PATHS."""
+  catalogs = {}
+  for locale_dir in settings.LOCALE_PATHS:
+    for locale in os.listdir(locale_dir):
+      if os.path.isdir(os.path.join(locale_dir, locale, 'LC_MESSAGES')):
+        catalogs[locale] = trans_real.translation(locale)
+  return catalogs
+
+
+# Loaded once per instance rather than on the first request in each locale.
+CATALOGS = load_catalogs()
+
+
+def get_catalog(locale):
+  catalog = CATALOGS.get(locale)
+  if catalog is None:
+    catalog = CATALOGS[locale] = trans_real.translation(locale)
+  return catalog
+
+
+def translate(locale, message):
+  """Translates |message| into |locale| like ugettext() would.
+
+  Line endings are normalized first, as ugettext() does, since the catalogs
+  are keyed by messages with plain newlines.
+  """
+  message = message.replace('\r\n', '\n').replace('\r', '\n')
+  return get_catalog(locale).ugettext(message)
+
+
+class ResourceStrings(object):
+  """Memo of the localized title and description of each resource.
+
+  A resource's strings are only translated if the article exists in the
+  locale. The memo is cleared whenever the data generation changes, so it
+  only holds the strings of current resources.
+  """
+
+  def __init__(self, basedir):
+    self.basedir = basedir
+    self._generation = None
+    self._strings = {}
+
+  def localize(self, r, locale, generation):
+    """Returns the (title, description) of resource |r| in |locale|."""
+    if generation != self._generation:
+      self._strings = {}
+      self._generation = generation
+
+    key = (locale, r.url, r.title, r.description)
+    strings = self._strings.get(key)
+    if strings is None:
+      title, description = r.title, r.description
+      filepath = os.path.join(self.basedir, 'content', r.url[1:], locale,
+                              'index.html')
+      if os.path.isfile(filepath):
+        if title:
+          title = translate(locale, title)
+        if description:
+          description = translate(locale, description)
+      strings = self._strings[key] = (title, description)
+    return strings
+
+
+RESOURCE_STRINGS = ResourceStrings(os.path.dirname(__file__))
+
+
+def build_content_index():
+  """Returns the paths of all HTML files under content/."""
+  paths = set()
+  for dirpath, dirnames, filenames in os.walk('content'):
+    paths.update(os.path.join(dirpath, f) for f in filenames
+                 if f.endswith('.html'))
+  return frozenset(paths)
+
+
+# Content only changes on deploy. The dev server checks the filesystem instead,
+# so that new articles show up without a restart.
+CONTENT_INDEX = settings.PROD and build_content_index() or None
+
+
+def content_exists(path):
+  """Whether |path| (e.g. content/tutorials/x/en/index.html) exists."""
+  if CONTENT_INDEX is None:
+    return os.path.isfile(path)
+  return os.path.normpath(path) in CONTENT_INDEX
+
+
+# Old-style mobile article and case study URLs, e.g. mobile/touch.html.
+OLD_STYLE_URL_RE = re.compile(
+    '(?P<type>mobile|tutorials/casestudies)/(?P<slug>[a-z-_0-9]+).html$')
+
+ARTICLE_URL_RE = re.compile('(?:tutorials|mobile|gaming|business)/.+')
+
+
+def resolve_redirect(locale, relpath, query=''):
+  """Returns where ContentHandler.get() ends up redirecting an article URL.
+
+  Follows, in one go, the redirects a request for |relpath| (without the
+  locale prefix) in |locale| would otherwise go through one round trip at a
+  time. Returns None if the URL is served as is.
+  """
+  redirected = False
+  while ARTICLE_URL_RE.search(relpath):
+    match = OLD_STYLE_URL_RE.search(relpath)
+    if match:
+      # Old-style mobile articles and case studies moved to the new style.
+      relpath = '%s/%s/' % (match.group('type'), match.group('slug'))
+      query = ''
+    elif relpath[-1] != '/' and not relpath.endswith('.html'):
+      # /tutorials/blah goes to /tutorials/blah/.
+      relpath += '/'
+    else:
+      # Articles missing in |locale| go to the English version, if any.
+      if relpath[-1] == '/':
+        (dir, filename) = (os.path.join('content', relpath), 'index.html')
+      else:
+        (dir, filename) = os.path.split(os.path.join('content', relpath))
+      if (content_exists(os.path.join(dir, locale, filename)) or
+          not content_exists(os.path.join(dir, 'en', filename))):
+        break
+      query = 'redirect_from_locale=%s' % locale
+      locale = 'en'
+    redirected = True
+
+  if not redirected:
+    return None
+  url = '/%s/%s' % (locale, relpath)
+  if query:
+    url += '?' + query
+  return url
+
+
+# Rendered 404 pages of recently requested URLs that don't exist, keyed by
+# page_key(). Content only changes on deploy, which also starts fresh instances
+# with an empty cache. Each entry holds a whole page, so only the most recent
+# few are kept.
+NOT_FOUND_CACHE = cache.LocalCache(max_size=100, time=300)
+
+# Page builds currently in progress on this instance, keyed by page_key().
+RENDER_FLIGHTS = cache.SingleFlight()
+
+# Pages rendered with placeholders for their per-request fields, split into
+# [text, field, text, field, ..., text]. See ContentHandler.render_skeleton().
+SKELETONS = cache.LocalCache(max_size=500, time=3600)
+SKELETON_TTL = 3600
+SKELETON_HOLE_RE = re.compile('@@page-hole:(\w+)@@')
+
+
+def fill_skeleton(parts, values):
+  """Returns the page of skeleton |parts| with its holes set to |values|."""
+  page = parts[:]
+  for i in xrange(1, len(page), 2):
+    page[i] = values[page[i]]
+  return u''.join(page)
+
+
+def build_toc(path):
+  """Returns the table of contents of the h2-h4 headings in template |path|.
+
+  The TOC is a dict with the list of headings as 'entries' and their markup
+  as 'html'.
+  """
+  template_text = render_to_string(path, {})
+
+  parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder("dom"),
+                               collectErrors=False)
+  dom_tree = parser.parse(template_text)
+  walker = treewalkers.getTreeWalker("dom")
+  stream = walker(dom_tree)
+  toc = []
+  current = None
+  for element in stream:
+    if element['type'] == 'StartTag':
+      if element['name'] in ['h2', 'h3', 'h4']:
+        for attr in element['data']:
+          if attr[0] == 'id':
+            current = {
+              'level' : int(element['name'][-1:]) - 1,
+              'id' : attr[1]
+            }
+    elif element['type'] == 'Characters' and current is not None:
+      current['text'] = element['data']
+    elif element['type'] == 'EndTag' and current is not None:
+      toc.append(current)
+      current = None
+  return {'entries': toc, 'html': render_toc(toc)}
+
+
+def build_feed(limit):
+  """Returns the Atom feed entries for the |limit| latest resources."""
+  # DB query is memcached in get_all().
+  tutorials = models.Resource.get_all(order='-publication_date', limit=limit)
+
+  articles = []
+  for tut in tutorials:
+    article = {}
+    article['title'] = tut.title
+    article['id'] = '-'.join(tut.title.lower().split())
+    article['href'] = tut.url
+    article['description'] = tut.description
+    article['author_id'] = tut.author.key().name()
+    if tut.second_author:
+      article['second_author'] = tut.second_author.key().name()
+    article['pubdate'] = datetime.datetime.strptime(
+                             str(tut.publication_date), '%Y-%m-%d')
+    article['categories'] = []
+    for tag in tut.tags:
+      article['categories'].append(tag)
+
+    articles.append(article)
+
+  return articles
+
+
 class ContentHandler(webapp2.RequestHandler):
 
   BASEDIR = os.path.dirname(__file__)
   FEED_RESULTS_LIMIT = 20
   FEATURE_PAGE_WHATS_NEW_LIMIT = 10
 
+  # Whether identical concurrent GET renders may share one build. Off for
+  # handlers whose pages depend on more than the URL.
+  COALESCE_RENDERS = True
+
+  # Whether GET pages are served from cached skeletons. See render_skeleton().
+  CACHE_SKELETONS = True
+
+  # TOCs and feeds are refreshed in the background once older than their TTL,
+  # and served stale until their stale TTL.
+  TOC_TTL = 3600
+  TOC_STALE_TTL = 86400
+  FEED_TTL = 86400
+  FEED_STALE_TTL = 7 * 86400
+
   def get_language(self):
     lang_match = re.match("^/(\w{2,3})(?:/|$)", self.request.path)
     return lang_match.group(1) if lang_match else None
@@ -62,6 +305,24 @@ class ContentHandler(webapp2.RequestHandler):
     logging.info("Set Language as %s" % self.locale)
     translation.activate( self.locale )
 
+  def dispatch(self):
+    # Admins can get a breakdown of template render times logged with
+    # ?profile=1. Profiled pages are rendered uncached.
+    profile = (self.request.get('profile') == '1' and
+               users.is_current_user_admin() and profiler.start())
+
+    # Memcache reads and writes made while handling the request are batched
+    # through a request-scoped cache. See cache.py.
+    cache.begin()
+    try:
+      super(ContentHandler, self).dispatch()
+    finally:
+      cache.end()
+      if profile:
+        profiler.stop()
+        logging.info('Template render profile for %s:\n%s',
+                     self.request.path, profile.report())
+
   def browser(self):
     return str(self.request.headers['User-Agent'])
 
@@ -69,69 +330,94 @@ class ContentHandler(webapp2.RequestHandler):
     browser = self.browser()
     return browser.find('Android') != -1 or browser.find('iPhone') != -1
 
+  def has_toc(self, path):
+    # Only have TOC on tutorial pages.
+    return bool(re.search('/tutorials', path) or re.search('/mobile', path))
+
+  def toc_key(self, path):
+    return '%s|toc2|%s' % (settings.MEMCACHE_KEY_PREFIX, path)
+
   def get_toc(self, path):
-    # Only have TOC on tutorial pages. Don't do work for others.
-    if not (re.search('/tutorials', path) or re.search('/mobile', path)):
+    # Don't do work for pages that have no TOC.
+    if not self.has_toc(path):
       return ''
 
-    toc = memcache.get('%s|toc|%s' % (settings.MEMCACHE_KEY_PREFIX, path))
-    if toc is None or not self.request.cache:
-      template_text = render_to_string(path, {})
+    return cache.get_or_compute(
+        self.toc_key(path), build_toc, args=(path,), time=self.TOC_TTL,
+        stale_time=self.TOC_STALE_TTL, refresh_in_background=True,
+        force=not self.request.cache)
 
-      parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder("dom"))
-      dom_tree = parser.parse(template_text)
-      walker = treewalkers.getTreeWalker("dom")
-      stream = walker(dom_tree)
-      toc = []
-      current = None
-      for element in stream:
-        if element['type'] == 'StartTag':
-          if element['name'] in ['h2', 'h3', 'h4']:
-            for attr in element['data']:
-              if attr[0] == 'id':
-                current = {
-                  'level' : int(element['name'][-1:]) - 1,
-                  'id' : attr[1]
-                }
-        elif element['type'] == 'Characters' and current is not None:
-          current['text'] = element['data']
-        elif element['type'] == 'EndTag' and current is not None:
-          toc.append(current)
-          current = None
-      memcache.set('%s|toc|%s' % (settings.MEMCACHE_KEY_PREFIX, path), toc, 3600)
-
-    return toc
+  def feed_key(self, path):
+    return '%s|feed|%s' % (settings.MEMCACHE_KEY_PREFIX, path)
 
   def get_feed(self, path):
-    articles = memcache.get('%s|feed|%s' % (settings.MEMCACHE_KEY_PREFIX, path))
-    if articles is None or not self.request.cache:
-      # DB query is memcached in get_all(). Limit to last several results
-      tutorials = models.Resource.get_all(order='-publication_date',
-                                          limit=self.FEED_RESULTS_LIMIT)
-
-      articles = []
-      for tut in tutorials:
-        article = {}
-        article['title'] = tut.title
-        article['id'] = '-'.join(tut.title.lower().split())
-        article['href'] = tut.url
-        article['description'] = tut.description
-        article['author_id'] = tut.author.key().name()
-        if tut.second_author:
-          article['second_author'] = tut.second_author.key().name()
-        article['pubdate'] = datetime.datetime.strptime(
-                                 str(tut.publication_date), '%Y-%m-%d')
-        article['categories'] = []
-        for tag in tut.tags:
-          article['categories'].append(tag)
-
-        articles.append(article)
-
-      # Cache feed for 24hrs.
-      memcache.set(
-          '%s|feed|%s' % (settings.MEMCACHE_KEY_PREFIX, path), articles, 86400)
-
-    return articles
+    return cache.get_or_compute(
+        self.feed_key(path), build_feed, args=(self.FEED_RESULTS_LIMIT,),
+        time=self.FEED_TTL, stale_time=self.FEED_STALE_TTL,
+        refresh_in_background=True, force=not self.request.cache)
+
+  def page_key(self, template_path, url=None):
+    """Identifies what render() outputs for |template_path| on this request."""
+    return '|'.join([template_path, url or self.request.url,
+                     str(self.is_awesome_mobile_device()),
+                     translation.get_language()])
+
+  def get_gdl_page_url(self):
+    """Returns the URL of the live GDL show, or '' if none is on air."""
+    # TODO: memcache this db query.
+    live_data = models.LiveData.all().get() # Return first result.
+
+    # Show banner if we have a URL and are under 60 minutes since it was
+    # saved.
+    if (live_data and
+        (datetime.datetime.now() - live_data.updated).seconds / 60 < 60):
+      return live_data.gdl_page_url
+    return ''
+
+  def render_skeleton(self, template_path, build_page, values):
+    """Renders a page from a skeleton shared by all requests for its path.
+
+    The skeleton is the page built by build_page(holes) with every field in
+    |values| replaced by a placeholder. Serving it only takes filling the
+    placeholders in with this request's (escaped) |values|. Fields that
+    decide which markup the page has rather than just what a value is, like
+    whether there's a GDL banner, are part of the skeleton's key instead.
+    """
+    holes = dict((name, '@@page-hole:%s@@' % name) for name in values)
+    redirect_from_locale = values.pop('redirect_from_locale', None)
+    if redirect_from_locale:
+      values['redirect_from_locale_lang'] = redirect_from_locale['lang']
+      values['redirect_from_locale_msg'] = redirect_from_locale['msg']
+      holes['redirect_from_locale'] = {
+        'lang': '@@page-hole:redirect_from_locale_lang@@',
+        'msg': '@@page-hole:redirect_from_locale_msg@@'
+      }
+    else:
+      holes['redirect_from_locale'] = redirect_from_locale
+    if not values['gdl_page_url']:
+      holes['gdl_page_url'] = ''
+
+    # The deployed version is part of the key, so that new templates aren't
+    # held back by skeletons rendered from the old ones.
+    key = '|'.join([
+        'skeleton', os.environ.get('CURRENT_VERSION_ID', ''),
+        str(models.get_generation()),
+        self.page_key(template_path, url=self.request.path),
+        str(bool(values['gdl_page_url'])), str(bool(redirect_from_locale))])
+    memcache_key = '%s|skeleton|%s' % (settings.MEMCACHE_KEY_PREFIX,
+                                       hashlib.md5(key).hexdigest())
+
+    def build_skeleton():
+      parts = SKELETONS.get(key) or cache.get(memcache_key)
+      if parts is None:
+        parts = SKELETON_HOLE_RE.split(build_page(holes))
+        cache.set(memcache_key, parts, SKELETON_TTL)
+      SKELETONS.set(key, parts)
+      return parts
+
+    parts = RENDER_FLIGHTS.do(key, build_skeleton)
+    return fill_skeleton(parts, dict((name, conditional_escape(value))
+                                     for (name, value) in values.iteritems()))
 
   def render(self, data={}, template_path=None, status=None,
              message=None, relpath=None):
@@ -162,46 +448,63 @@ class ContentHandler(webapp2.RequestHandler):
       pagename = re.sub('/$|-$', '', pagename)
       pagename = re.sub('^-', '', pagename)
 
-    # Add template data to every request.
-    template_data = {
-      'toc': self.get_toc(template_path),
-      'self_url': self.request.url,
-      'self_pagename': pagename,
-      'host': '%s://%s' % (self.request.scheme, self.request.host),
-      'is_mobile': self.is_awesome_mobile_device(),
-      'current': current,
-      'prod': settings.PROD
-    }
-
-    # If the tutorial contains a social URL override, use it.
-    template_data['disqus_url'] = template_data['host'] + '/' + path_no_lang
-    if data.get('tut') and data['tut'].social_url:
-      template_data['disqus_url'] = (template_data['host'] +
-                                     data['tut'].social_url)
-
     # Request was for an Atom feed. Render one!
     if self.request.path.endswith('.xml'):
       self.render_atom_feed(template_path, self.get_feed(template_path))
       return
 
-    template_data.update(data)
-    if not 'category' in template_data:
-      template_data['category'] = _('this feature')
+    host = '%s://%s' % (self.request.scheme, self.request.host)
 
-    # Add GDL url.
-    # TODO: memcache this db query.
-    template_data['gdl_page_url'] = ''
-    live_data = models.LiveData.all().get() # Return first result.
+    # If the tutorial contains a social URL override, use it.
+    disqus_url = host + '/' + path_no_lang
+    if data.get('tut') and data['tut'].social_url:
+      disqus_url = host + data['tut'].social_url
 
-    # Show banner if we have a URL and are under 60 minutes since it was saved.
-    if (live_data and
-        (datetime.datetime.now() - live_data.updated).seconds / 60 < 60):
-      template_data['gdl_page_url'] = live_data.gdl_page_url
+    def build_page(holes=None):
+      # Add template data to every request.
+      template_data = {
+        'toc': self.get_toc(template_path),
+        'self_url': self.request.url,
+        'self_pagename': pagename,
+        'host': host,
+        'is_mobile': self.is_awesome_mobile_device(),
+        'current': current,
+        'prod': settings.PROD,
+        'disqus_url': disqus_url
+      }
+
+      template_data.update(data)
+      if not 'category' in template_data:
+        template_data['category'] = _('this feature')
+
+      if holes is None:
+        # Add GDL url.
+        template_data['gdl_page_url'] = self.get_gdl_page_url()
+      else:
+        template_data.update(holes)
+
+      return render_to_string(template_path, template_data)
+
+    if (self.CACHE_SKELETONS and self.request.method == 'GET' and
+        self.request.cache and status in (None, 200)):
+      page = self.render_skeleton(template_path, build_page, {
+        'self_url': self.request.url,
+        'host': host,
+        'disqus_url': disqus_url,
+        'gdl_page_url': self.get_gdl_page_url(),
+        'redirect_from_locale': data.get('redirect_from_locale')
+      })
+    # Concurrent requests for the same page on this instance share one build.
+    elif (self.COALESCE_RENDERS and self.request.method == 'GET' and
+          self.request.cache):
+      page = RENDER_FLIGHTS.do(self.page_key(template_path), build_page)
+    else:
+      page = build_page()
 
     # Add CORS support entire site.
     self.response.headers.add_header('Access-Control-Allow-Origin', '*')
     self.response.headers.add_header('X-UA-Compatible', 'IE=Edge,chrome=1')
-    self.response.out.write(render_to_string(template_path, template_data))
+    self.response.out.write(page)
 
   def render_atom_feed(self, template_path, data):
     prefix = '%s://%s' % (self.request.scheme, self.request.host)
@@ -229,13 +532,117 @@ class ContentHandler(webapp2.RequestHandler):
     self.response.headers.add_header('Content-Type', 'application/atom+xml')
     self.response.out.write(feed.writeString('utf-8'))
 
+  def _get_page_params(self):
+    """Parses ?limit=, ?cursor= and ?fields= into (offset, limit, fields).
+
+    Cursors are opaque to clients; they encode the offset of the next record.
+    Raises ValueError on malformed values.
+    """
+    limit = self.request.get('limit')
+    if limit:
+      limit = min(int(limit), settings.MAX_FETCH_LIMIT)
+      if limit < 1:
+        raise ValueError('limit must be positive')
+    else:
+      limit = None
+
+    offset = 0
+    cursor = self.request.get('cursor')
+    if cursor:
+      offset = int(base64.urlsafe_b64decode(str(cursor)).split(':')[1])
+      if offset < 0:
+        raise ValueError('bad cursor')
+
+    fields = sorted(set(f.strip() for f in self.request.get('fields').split(',')
+                        if f.strip()))
+    return offset, limit, fields
+
+  def write_json(self, name, build_records, key=None):
+    """Writes a page of the records for |name| as JSON.
+
+    |build_records| returns the full, ordered list of records. The requested
+    page is projected to ?fields= and written as a list, or as a dict keyed by
+    key(record) if |key| is given. The encoded body, its ETag and the next
+    page's cursor are cached per (name, page, fields) under the current data
+    generation, so any write to the datastore invalidates every entry at once.
+    """
+    try:
+      offset, limit, fields = self._get_page_params()
+    except (ValueError, IndexError, TypeError):
+      self.response.set_status(400)
+      self.response.out.write('Bad limit, cursor or fields parameter.')
+      return
+
+    cache_key = '%s|json|%s|%s|%s|%s|%s' % (
+        settings.MEMCACHE_KEY_PREFIX, models.get_generation(), name,
+        offset, limit or '', ','.join(fields))
+    def build_entry():
+      records = build_records()
+      end = limit and offset + limit
+      page = records[offset:end]
+
+      next_cursor = None
+      if end and end < len(records):
+        next_cursor = base64.urlsafe_b64encode('o:%d' % end)
+
+      if fields:
+        project = lambda r: dict((f, r[f]) for f in fields if f in r)
+      else:
+        project = lambda r: r
+      if key is None:
+        output = [project(r) for r in page]
+      else:
+        output = dict((key(r), project(r)) for r in page)
+
+      body = _json_encoder.encode(output)
+      return ('"%s"' % hashlib.md5(body).hexdigest(), body, next_cursor)
+
+    entry = cache.get_or_compute(cache_key, build_entry,
+                                 force=not self.request.cache)
+    etag, body, next_cursor = entry
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.headers['ETag'] = etag
+    if next_cursor:
+      # urlencode() only takes byte strings, and query values are unicode.
+      params = dict((unicode(k).encode('utf-8'), unicode(v).encode('utf-8'))
+                    for k, v in self.request.GET.iteritems())
+      params['cursor'] = next_cursor
+      self.response.headers['X-Next-Cursor'] = next_cursor
+      self.response.headers['Link'] = '<%s?%s>; rel="next"' % (
+          self.request.path_url, urllib.urlencode(params))
+    if etag.strip('"') in self.request.if_none_match:
+      self.response.set_status(304)
+      return
+    self.response.out.write(body)
+
   def _set_cache_param(self):
     # Render uncached verion of page with ?cache=1
-    if self.request.get('cache', default_value='1') == '1':
+    if (self.request.get('cache', default_value='1') == '1' and
+        profiler.current() is None):
       self.request.cache = True
     else:
       self.request.cache = False
 
+  def _prefetch(self, relpath, path, locale, is_feed):
+    """Fetches the memcache entries get() may read in one round trip."""
+    keys = [models.GENERATION_KEY,
+            models.Resource.get_all_key(order='-publication_date')]
+    if relpath in ['profiles', 'profiles/']:
+      keys.append(models.PROFILES_KEY)
+
+    (dir, filename) = os.path.split(path)
+    template_paths = [path, os.path.join(dir, locale, filename)]
+    if is_feed:
+      template_paths.append(path[:path.rfind('.')] + '.html')
+    for template_path in template_paths:
+      if self.has_toc(template_path):
+        keys.append(self.toc_key(template_path))
+      if is_feed:
+        keys.append(self.feed_key(template_path))
+
+    cache.prefetch(keys)
+
   def get(self, relpath):
 
     self._set_cache_param()
@@ -254,10 +661,16 @@ class ContentHandler(webapp2.RequestHandler):
                          template_path='content/humans.txt',
                          relpath=relpath)
 
-    # Get the locale: if it's "None", redirect to English
+    # Are we looking for a feed?
+    is_feed = self.request.path.endswith('.xml')
+
+    # Get the locale: if it's "None", redirect to English, straight to
+    # wherever the English URL would redirect to. Where that is only depends
+    # on the deployed content, so the redirect is permanent either way.
     locale = self.get_language()
     if not locale:
-      return self.redirect("/en/%s" % relpath, permanent=True)
+      url = not is_feed and resolve_redirect('en', relpath)
+      return self.redirect(url or "/en/%s" % relpath, permanent=True)
 
     # If there is a locale specified but it has no leading slash, redirect
     if not relpath.startswith("%s/" % locale):
@@ -267,13 +680,21 @@ class ContentHandler(webapp2.RequestHandler):
     # so let's activate it
     self.activate_language(locale)
 
+    # Known-missing pages get the 404 page rendered last time, without going
+    # through the redirect logic and the filesystem probes below. The key
+    # includes the language and device class the page was rendered for.
+    not_found_key = self.page_key('404.html')
+    not_found_body = self.request.cache and NOT_FOUND_CACHE.get(not_found_key)
+    if not_found_body:
+      self.response.set_status(404, 'Page Not Found')
+      self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+      self.response.headers.add_header('X-UA-Compatible', 'IE=Edge,chrome=1')
+      self.response.out.write(not_found_body)
+      return
     
     # Strip off leading `/[en|de|fr|...]/`
     relpath = re.sub('^/?\w{2,3}(?:/)?', '', relpath)
 
-    # Are we looking for a feed?
-    is_feed = self.request.path.endswith('.xml')
-
     logging.info('relpath: ' + relpath)
     # Setup handling of redirected article URLs: If a user tries to access an
     # article from a non-supported language, we'll redirect them to the
@@ -283,13 +704,12 @@ class ContentHandler(webapp2.RequestHandler):
     if not re.match('[a-zA-Z]{2,3}$', redirect_from_locale):
       redirect_from_locale = False
     else:
-      translation.activate(redirect_from_locale)
       redirect_from_locale = {
         'lang': redirect_from_locale,
-        'msg': _('Sorry, this article isn\'t available in your native '
-                 'language; we\'ve redirected you to the English version.')
+        'msg': translate(redirect_from_locale,
+            'Sorry, this article isn\'t available in your native '
+            'language; we\'ve redirected you to the English version.')
       }
-      translation.activate(locale)
 
     # Landing page or /tutorials|features|mobile|gaming|business\/?
     if ((relpath == '' or relpath[-1] == '/') or  # Landing page.
@@ -299,11 +719,15 @@ class ContentHandler(webapp2.RequestHandler):
     else:
       path = os.path.join('content', relpath)
 
+    self._prefetch(relpath, path, locale, is_feed)
+
     # Render the .html page if it exists. Otherwise, check that the Atom feed
     # the user is requesting has a corresponding .html page that exists.
 
     if (relpath == 'profiles' or relpath == 'profiles/'):
       profiles = models.get_sorted_profiles()
+      cache.prefetch([models.Resource.tutorials_by_author_key(p['id'])
+                      for p in profiles])
       for p in profiles:
         p['tuts_by_author'] = models.Resource.get_tutorials_by_author(p['id'])
       self.render(data={'sorted_profiles': profiles},
@@ -314,18 +738,12 @@ class ContentHandler(webapp2.RequestHandler):
            re.search('business/.+', relpath) or
            re.search('tutorials/casestudies/.+', relpath))
           and not is_feed):
-      # If this is an old-style mobile article or case study, redirect to the
-      # new style.
-      match = re.search(('(?P<type>mobile|tutorials/casestudies)'
-                         '/(?P<slug>[a-z-_0-9]+).html$'), relpath)
-      if match:
-        logging.info("Redirecting from old-style URL to the new hotness.")
-        return self.redirect('/%s/%s/%s/' % (locale, match.group('type'),
-                                             match.group('slug')))
-
-      # If no trailing / (e.g. /tutorials/blah), redirect to /tutorials/blah/.
-      if (relpath[-1] != '/' and not relpath.endswith('.html')):
-        return self.redirect(self.request.url + '/')
+      # Old-style URLs, missing trailing slashes and articles that aren't
+      # available in |locale| all redirect, in a single hop.
+      url = resolve_redirect(locale, relpath, self.request.query_string)
+      if url:
+        logging.info('Redirecting to %s', url)
+        return self.redirect(url)
 
       # Tutorials look like this on the filesystem:
       #
@@ -342,7 +760,7 @@ class ContentHandler(webapp2.RequestHandler):
       # `split` the file's path, add in the locale, and check existence:
       logging.info('Building request for `%s` in locale `%s`', path, locale)
       (dir, filename) = os.path.split(path)
-      if os.path.isfile(os.path.join(dir, locale, filename)):
+      if content_exists(os.path.join(dir, locale, filename)):
         # Lookup tutorial by its url. Return the first one that matches.
         # get_all() not used because we don't care about caching on individual
         # tut page.
@@ -387,13 +805,6 @@ class ContentHandler(webapp2.RequestHandler):
         }
         self.render(template_path=os.path.join(dir, locale, filename),
                     data=data, relpath=relpath)
-
-      # If the localized file doesn't exist, and the locale isn't English, look
-      # for an english version of the file, and redirect the user there if
-      # it's found:
-      elif os.path.isfile( os.path.join(dir, 'en', filename)):
-        return self.redirect("/en/%s?redirect_from_locale=%s" % (relpath,
-                                                                 locale))
     elif os.path.isfile(path):
       #TODO(ericbidelman): Don't need these tutorial/update results for query.
       if relpath in ['mobile', 'gaming', 'business']:
@@ -402,6 +813,7 @@ class ContentHandler(webapp2.RequestHandler):
       else:
         results = models.Resource.get_all(order='-publication_date')
 
+      generation = models.get_generation()
       tutorials = [] # List of final result set.
       authors = [] # List of authors related to the result set.
       for r in results:
@@ -411,13 +823,8 @@ class ContentHandler(webapp2.RequestHandler):
 
         if r.url.startswith('/'):
           # Localize title and description if article is localized.
-          filepath = os.path.join(self.BASEDIR, 'content', r.url[1:], self.locale,
-                                  'index.html')
-          if os.path.isfile(filepath):
-            if r.title:
-              r.title = _(r.title)
-            if r.description:
-              r.description = _(r.description)
+          r.title, r.description = RESOURCE_STRINGS.localize(
+              r, self.locale, generation)
           # Point the article to the localized version, regardless.
           r.url = "/%s%s" % (self.locale, r.url)
 
@@ -449,13 +856,11 @@ class ContentHandler(webapp2.RequestHandler):
       category = relpath.replace('features/', '')
       updates = TagsHandler().get_as_db(
           'class:' + category, limit=self.FEATURE_PAGE_WHATS_NEW_LIMIT)
+      generation = models.get_generation()
       for r in updates:
         if r.url.startswith('/'):
           # Localize title if article is localized.
-          filepath = os.path.join(self.BASEDIR, 'content', r.url[1:], self.locale,
-                                  'index.html')
-          if r.url.startswith('/') and os.path.isfile(filepath) and r.title:
-            r.title = _(r.title)
+          r.title = RESOURCE_STRINGS.localize(r, self.locale, generation)[0]
           # Point the article to the localized version, regardless.
           r.url = "/%s%s" % (self.locale, r.url)
 
@@ -473,6 +878,7 @@ class ContentHandler(webapp2.RequestHandler):
 
     else:
       self.render(status=404, message='Page Not Found', template_path='404.html')
+      NOT_FOUND_CACHE.set(not_found_key, self.response.body)
 
   def handle_exception(self, exception, debug_mode):
     if debug_mode:
@@ -484,6 +890,10 @@ class ContentHandler(webapp2.RequestHandler):
 
 class DBHandler(ContentHandler):
 
+  COALESCE_RENDERS = False
+  CACHE_SKELETONS = False
+  EXPORT_BATCH_SIZE = 200
+
   def _ImportBackupResources(self, file_name):
     f = file(os.path.dirname(__file__) + file_name, 'r')
     for res in yaml.load_all(f):
@@ -512,22 +922,23 @@ class DBHandler(ContentHandler):
         pass # TODO(ericbidelman): Not sure why this is throwing an error, but
              # ignore it, whatever it is.
     f.close()
+    models.bump_generation()
 
   def _AddTestResources(self):
     #memcache.delete('tutorials')
-    memcache.flush_all()
+    cache.flush_all()
     self._ImportBackupResources('/database/tutorials.yaml')
 
   def _AddTestPlaygroundSamples(self):
-    memcache.flush_all()
+    cache.flush_all()
     self._ImportBackupResources('/database/playground.yaml')
 
   def _AddTestStudioSamples(self):
-    memcache.flush_all()
+    cache.flush_all()
     self._ImportBackupResources('/database/studio.yaml')
 
   def _AddTestAuthors(self):
-    memcache.flush_all()
+    cache.flush_all()
     f = file(os.path.dirname(__file__) + '/database/profiles.yaml', 'r')
     for profile in yaml.load_all(f):
       author = models.Author(
@@ -549,6 +960,7 @@ class DBHandler(ContentHandler):
           )
       author.put()
     f.close()
+    models.bump_generation()
 
   def _NukeDB(self):
     authors = models.Author.all()
@@ -559,10 +971,53 @@ class DBHandler(ContentHandler):
     for resource in resources:
       resource.delete()
 
-    memcache.flush_all()
+    cache.flush_all()
+    models.bump_generation()
+
+  def _Export(self, kind):
+    """Streams every entity of |kind| as newline-delimited JSON.
+
+    Entities are fetched in batches of EXPORT_BATCH_SIZE and each record is
+    written as soon as it is encoded, so only one batch is held at a time.
+    """
+    if kind == 'resources':
+      query = models.Resource.all().order('-publication_date')
+      def to_record(resource):
+        record = resource.to_record()
+        record['id'] = resource.key().id()
+        return record
+    elif kind == 'authors':
+      query = models.Author.all()
+      def to_record(author):
+        record = author.to_dict()
+        record['id'] = author.key().name()
+        record['geo_location'] = str(author.geo_location)
+        return record
+    else:
+      self.response.set_status(404)
+      return
+
+    self.response.headers['Content-Type'] = 'application/x-ndjson'
+    self.response.headers['Content-Disposition'] = (
+        'attachment; filename=%s.ndjson' % kind)
+
+    cursor = None
+    while True:
+      if cursor is not None:
+        query.with_cursor(cursor)
+      batch = query.fetch(limit=self.EXPORT_BATCH_SIZE)
+      for entity in batch:
+        self.response.out.write(_json_encoder.encode(to_record(entity)))
+        self.response.out.write('\n')
+      if len(batch) < self.EXPORT_BATCH_SIZE:
+        break
+      cursor = query.cursor()
 
   # /database/resource
   # /database/resource/1234
+  # /database/export/resources
+  # /database/export/authors
+  # /database/stats
   # /database/load_all
   # /database/drop_all
   # /database/author
@@ -605,6 +1060,17 @@ class DBHandler(ContentHandler):
                          template_path='database/author_new.html',
                          relpath=relpath)
 
+    elif (relpath == 'export'):
+      return self._Export(post_id)
+
+    elif (relpath == 'stats'):
+      # Cache statistics of the instance that served this request.
+      self.response.headers['Content-Type'] = 'application/json'
+      return self.response.out.write(_json_encoder.encode({
+        'render_coalescing': RENDER_FLIGHTS.stats(),
+        'not_found_cache': NOT_FOUND_CACHE.stats()
+      }))
+
     elif (relpath == 'drop_all'):
       if settings.PROD:
         return self.response.out.write('Handler not allowed in production.')  
@@ -798,103 +1264,176 @@ class DBHandler(ContentHandler):
 
     # TODO: Don't use flush_all. Use flush_all_async() or only purge tutorials.
     # Once new entry is saved, flush memcache.
-    memcache.flush_all()
+    cache.flush_all()
+    models.bump_generation()
 
     return self.redirect('/database/')
 
 
 class APIHandler(ContentHandler):
 
-  def get(self, relpath):
-    output = []
-
-    if relpath == 'authors':
-      profiles = {}
-      for p in models.get_sorted_profiles(): # This query is memcached.
-        profile_id = p['id']
-        profiles[profile_id] = p
-        geo_location = profiles[profile_id]['geo_location']
-        profiles[profile_id]['geo_location'] = str(geo_location)
-      output = profiles
-    elif relpath == 'tutorials':
-      output = TagsHandler()._query_to_serializable_list(
-         TagsHandler().get_as_db('type:tutorial'))
-    elif relpath == 'articles':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:article'))
-    elif relpath == 'casestudies':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:casestudy'))
-    elif relpath == 'demos':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:demo'))
-    elif relpath == 'samples':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:sample'))
-    elif relpath == 'presentations':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:presentation'))
-    elif relpath == 'announcements':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:announcement'))
-    elif relpath == 'videos':
-      output = TagsHandler()._query_to_serializable_list(
-          TagsHandler().get_as_db('type:video'))
+  SEARCH_RESULTS_LIMIT = 10
+
+  # /api/<type> -> the resource tag it lists.
+  RESOURCE_TYPES = {
+    'tutorials': 'type:tutorial',
+    'articles': 'type:article',
+    'casestudies': 'type:casestudy',
+    'demos': 'type:demo',
+    'samples': 'type:sample',
+    'presentations': 'type:presentation',
+    'announcements': 'type:announcement',
+    'videos': 'type:video'
+  }
+
+  def _get_authors(self):
+    profiles = []
+    for p in models.get_sorted_profiles(): # This query is memcached.
+      # Copy so the cached profile itself is never modified.
+      profile = dict(p)
+      profile['geo_location'] = str(p['geo_location'])
+      profiles.append(profile)
+    return profiles
+
+  def _get_changes(self, since):
+    """Returns records for resources created, updated or unpublished on or
+    after the date |since|.
+
+    Resources that are now drafts come back as {'id': ..., 'deleted': True}
+    tombstones so that mirrors can drop them.
+    """
+    changed = {}
+    for prop in ['update_date', 'publication_date']:
+      query = models.Resource.all().filter('%s >=' % prop, since)
+      for r in query.fetch(limit=settings.MAX_FETCH_LIMIT):
+        changed[r.key().id()] = r
+
+    records = []
+    for resource_id, r in changed.iteritems():
+      if r.draft:
+        record = {'id': resource_id, 'deleted': True}
+      else:
+        record = r.to_record()
+        record['id'] = resource_id
+      records.append(record)
+    records.sort(key=lambda record: record['id'])
+    return records
+
+  def _parse_since(self):
+    """Returns the date to sync from, given ?since=YYYY-MM-DD or a ?token=
+    previously handed out in X-Sync-Token. Raises ValueError if invalid.
+    """
+    token = self.request.get('token')
+    if token:
+      kind, since = base64.urlsafe_b64decode(str(token)).split(':', 1)
+      if kind != 's':
+        raise ValueError('bad sync token')
+    else:
+      since = self.request.get('since')
+    return datetime.datetime.strptime(since, '%Y-%m-%d').date()
+
+  def _search(self):
+    """Answers ?q= from the local full-text index for the locale in ?hl=."""
+    index = search.get_index(settings.SEARCH_INDEX_PATH)
+    if index is None:
+      logging.error('Search index missing. Run scripts/build_search_index.py')
+      self.response.set_status(503)
+      self.response.out.write('Search is unavailable.')
+      return
+
+    try:
+      limit = min(int(self.request.get('limit') or self.SEARCH_RESULTS_LIMIT),
+                  settings.MAX_FETCH_LIMIT)
+    except ValueError:
+      limit = self.SEARCH_RESULTS_LIMIT
+
+    results = index.query(self.request.get('q'),
+                          self.request.get('hl') or settings.LANGUAGE_CODE,
+                          default_locale=settings.LANGUAGE_CODE, limit=limit)
 
     self.response.headers.add_header('Access-Control-Allow-Origin', '*')
     self.response.headers['Content-Type'] = 'application/json'
-    self.response.out.write(simplejson.dumps(output))
+    self.response.out.write(_json_encoder.encode(
+        [{'url': url, 'title': title, 'score': round(score, 4)}
+         for (score, url, title) in results]))
+
+  # /api/tutorials
+  # /api/tutorials?limit=20&fields=title,url,publication_date
+  # /api/tutorials?limit=20&cursor=<X-Next-Cursor of the previous page>
+  # /api/changes?since=2012-10-01
+  # /api/changes?token=<X-Sync-Token of the previous sync>
+  # /api/search?q=web+workers&hl=de
+  def get(self, relpath):
+    self._set_cache_param()
 
+    if relpath == 'search':
+      return self._search()
+    elif relpath == 'authors':
+      return self.write_json('api|authors', self._get_authors,
+                             key=lambda p: p['id'])
+    elif relpath == 'changes':
+      try:
+        since = self._parse_since()
+      except (ValueError, TypeError):
+        self.response.set_status(400)
+        self.response.out.write('Expected ?since=YYYY-MM-DD or ?token=.')
+        return
 
-class TagsHandler(ContentHandler):
+      # Dates have day granularity, so the next sync starts from today and
+      # may repeat today's changes. Applying a record twice is harmless.
+      today = datetime.date.today()
+      self.response.headers['X-Sync-Token'] = base64.urlsafe_b64encode(
+          's:%s' % today.isoformat())
+      return self.write_json('api|changes|%s|%s' % (since, today),
+                             lambda: self._get_changes(since))
+    elif relpath in self.RESOURCE_TYPES:
+      tag = self.RESOURCE_TYPES[relpath]
+      build_records = lambda: TagsHandler()._query_to_serializable_list(
+          TagsHandler().get_as_db(tag))
+    else:
+      build_records = list
 
-  def _query_to_serializable_list(self, results):
-    resources = []
-    for r in results:
-      second_author = None
-      if r.second_author:
-        second_author = r.second_author.key().name()
+    self.write_json('api|%s' % relpath, build_records)
 
-      update_date = r.update_date
-      if update_date:
-        update_date = r.update_date.isoformat()
 
-      resources.append(r.to_dict())
-      resources[-1]['publication_date'] = r.publication_date.isoformat()
-      resources[-1]['update_date'] = update_date
-      resources[-1]['author'] = r.author.key().name()
-      resources[-1]['second_author'] = second_author
+class TagsHandler(ContentHandler):
 
-    return resources
+  def _query_to_serializable_list(self, results):
+    return [r.to_record() for r in results]
 
   def _get(self, tag, order=None, limit=None):
     tag = urllib2.unquote(tag)
 
     order = order or '-publication_date'
 
+    # Publication date orders are answered from the in-memory tag index. It
+    # also understands combinations such as 'class:offline+type:tutorial'.
+    if order in ['-publication_date', 'publication_date']:
+      return models.get_tag_index().query(
+          tag, limit=limit, reverse=(order == 'publication_date'))
+
     # DB query is memcached in get_all().
     return models.Resource.get_all(order=order, qfilter=('tags =', tag),
                                    limit=limit)
 
   # /tags/json/type:demo
+  # /tags/json/type:demo?limit=10&fields=title,url
   # /tags/json/class:file_access
+  # /tags/json/class:offline+type:tutorial (both tags)
+  # /tags/json/type:demo,type:sample (either tag)
   # /tags/json/dnd
   # /tags/db/dnd
   def get(self, format, tag):
+    self._set_cache_param()
+
     if format == 'json':
       return self.get_as_json(tag)
     elif format == 'db':
       return self.get_as_db(tag)
 
   def get_as_json(self, tag):
-    results = self._get(tag)
-
-    resources = self._query_to_serializable_list(results)
-
-    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
-    self.response.headers['Content-Type'] = 'application/json'
-    self.response.out.write(simplejson.dumps(resources))
-    return
+    self.write_json('tags|%s' % tag,
+                    lambda: self._query_to_serializable_list(self._get(tag)))
 
   def get_as_db(self, tag, order=None, limit=None):
     return self._get(tag, order=order, limit=limit)
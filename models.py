@@ -1,30 +1,90 @@
+import copy
+import threading
+import time
+
 from google.appengine.api import memcache
 from google.appengine.ext import db
 #from google.appengine.ext.db import djangoforms
 from django import forms
 
+import cache
 import settings
 
-def get_profiles(update_cache=False):
-  profiles = memcache.get('%s|profiles' % (settings.MEMCACHE_KEY_PREFIX))
-  if profiles is None or update_cache:
-    profiles = {}
-    authors = Author.all().fetch(limit=settings.MAX_FETCH_LIMIT)
-
-    for author in authors:
-      author_id = author.key().name()
-      profiles[author_id] = author.to_dict()
-      profiles[author_id]['id'] = author_id
-
-    memcache.set('%s|profiles' % (settings.MEMCACHE_KEY_PREFIX), profiles)
+GENERATION_KEY = '%s|generation' % (settings.MEMCACHE_KEY_PREFIX,)
+PROFILES_KEY = '%s|profiles' % (settings.MEMCACHE_KEY_PREFIX,)
+
+def get_generation():
+  """Returns the current data generation.
+
+  The generation changes whenever authors or resources are written, so it can
+  be folded into cache keys for values derived from datastore content. It is
+  seeded from the clock so that a memcache flush never hands out a generation
+  that was already used before the flush.
+  """
+  generation = cache.get(GENERATION_KEY)
+  if generation is None:
+    memcache.add(GENERATION_KEY, int(time.time() * 1000))
+    cache.invalidate(GENERATION_KEY)
+    generation = cache.get(GENERATION_KEY) or 0
+  return generation
+
+def bump_generation():
+  if memcache.incr(GENERATION_KEY) is None:
+    memcache.add(GENERATION_KEY, int(time.time() * 1000))
+  cache.invalidate(GENERATION_KEY)
+
+def _build_profiles():
+  profiles = {}
+  authors = Author.all().fetch(limit=settings.MAX_FETCH_LIMIT)
+
+  for author in authors:
+    author_id = author.key().name()
+    profiles[author_id] = author.to_dict()
+    profiles[author_id]['id'] = author_id
 
   return profiles
 
+def get_profiles(update_cache=False):
+  return cache.get_or_compute(PROFILES_KEY, _build_profiles,
+                              force=update_cache)
+
 def get_sorted_profiles(update_cache=False):
   return sorted(get_profiles(update_cache).values(),
                 key=lambda profile:profile['family_name'])
 
 
+class ProfileRegistry(object):
+  """This instance's author profiles as of one data generation.
+
+  Template tags look authors up in |profiles| and keep the bylines they
+  render in |bylines|, keyed by tag and author ids, for as long as the
+  generation lasts.
+  """
+
+  def __init__(self, generation, profiles):
+    self.generation = generation
+    self.profiles = profiles
+    self.bylines = {}
+
+
+_profile_registry = None
+_profile_registry_lock = threading.Lock()
+
+def get_profile_registry():
+  """Returns this instance's ProfileRegistry, reloaded on generation changes."""
+  global _profile_registry
+
+  generation = get_generation()
+  registry = _profile_registry
+  if registry is None or registry.generation != generation:
+    with _profile_registry_lock:
+      registry = _profile_registry
+      if registry is None or registry.generation != generation:
+        registry = ProfileRegistry(generation, get_profiles())
+        _profile_registry = registry
+  return registry
+
+
 class DictModel(db.Model):
   def to_dict(self):
     #unicode(getattr(self, p)) if p is not None else None
@@ -87,8 +147,32 @@ class Resource(DictModel):
   tags = db.StringListProperty()
   draft = db.BooleanProperty(default=True) # Don't publish by default.
 
+  def to_record(self):
+    """Returns a JSON-ready dict of this resource.
+
+    Author references are read as raw keys so that building a record never
+    fetches the referenced Author entities.
+    """
+    author = Resource.author.get_value_for_datastore(self)
+    second_author = Resource.second_author.get_value_for_datastore(self)
+    return {
+      'title': self.title,
+      'description': self.description,
+      'author': author and author.name(),
+      'second_author': second_author and second_author.name(),
+      'url': self.url,
+      'social_url': self.social_url,
+      'browser_support': self.browser_support,
+      'update_date': self.update_date and self.update_date.isoformat(),
+      'publication_date': (self.publication_date and
+                           self.publication_date.isoformat()),
+      'tags': self.tags,
+      'draft': self.draft,
+    }
+
   @classmethod
-  def get_all(self, order=None, limit=None, qfilter=None):
+  def get_all_key(self, order=None, limit=None, qfilter=None):
+    """Returns the memcache key get_all() caches its results under."""
     limit = limit or settings.MAX_FETCH_LIMIT
 
     key = '%s|tutorials' % (settings.MEMCACHE_KEY_PREFIX,)
@@ -100,24 +184,35 @@ class Resource(DictModel):
       key += '|%s%s' % (qfilter[0], qfilter[1])
 
     key += '|%s' % (str(limit),)
+    return key
+
+  @classmethod
+  def get_all(self, order=None, limit=None, qfilter=None):
+    limit = limit or settings.MAX_FETCH_LIMIT
 
-    results = memcache.get(key)
-    if results is None:
+    def fetch():
       query = self.all()
       query.order(order)
       if qfilter is not None:
         query.filter(qfilter[0], qfilter[1])
       query.filter('draft =', False) # Never return drafts by default.
-      results = query.fetch(limit=limit)
-      memcache.set(key, results)
+      return query.fetch(limit=limit)
+
+    results = cache.get_or_compute(
+        self.get_all_key(order=order, limit=limit, qfilter=qfilter), fetch)
+
+    # The cached list may be handed to several callers in one request, and
+    # callers localize and rewrite the entities in place.
+    return [copy.copy(r) for r in results]
 
-    return results
+  @classmethod
+  def tutorials_by_author_key(self, author_id):
+    """Returns the memcache key get_tutorials_by_author() caches under."""
+    return '%s|tutorials_by|%s' % (settings.MEMCACHE_KEY_PREFIX, author_id)
 
   @classmethod
   def get_tutorials_by_author(self, author_id):
-    tutorials_by_author = memcache.get(
-        '%s|tutorials_by|%s' % (settings.MEMCACHE_KEY_PREFIX, author_id))
-    if tutorials_by_author is None:
+    def fetch():
       tutorials_by_author1 = Author.get_by_key_name(author_id).author_one_set
       tutorials_by_author2 = Author.get_by_key_name(author_id).author_two_set
 
@@ -127,12 +222,80 @@ class Resource(DictModel):
 
       # Order by published date. Latest first.
       tutorials_by_author.sort(key=lambda x: x.publication_date, reverse=True)
-
-      memcache.set(
-          '%s|tutorials_by|%s' % (settings.MEMCACHE_KEY_PREFIX, author_id),
-          tutorials_by_author)
-
-    return tutorials_by_author
+      return tutorials_by_author
+
+    return cache.get_or_compute(self.tutorials_by_author_key(author_id), fetch)
+
+
+class TagIndex(object):
+  """In-memory inverted index from tag to published resources.
+
+  Built from a single snapshot of every published resource, ordered newest
+  first. Each tag maps to the ascending list of snapshot positions of the
+  resources carrying it, so positions double as publication date order.
+  """
+
+  def __init__(self, generation, resources):
+    self.generation = generation
+    self.resources = resources
+    self.positions = {}
+    for position, r in enumerate(resources):
+      for tag in set(r.tags):
+        self.positions.setdefault(tag, []).append(position)
+
+  def _match(self, expr):
+    """Returns the sorted positions matching |expr|.
+
+    Tags joined with '+' must all be present; groups separated by ',' are
+    alternatives, e.g. 'class:offline+type:tutorial,type:demo'.
+    """
+    if ',' not in expr and '+' not in expr:
+      return self.positions.get(expr, [])
+
+    matched = set()
+    for group in expr.split(','):
+      tags = [tag for tag in group.split('+') if tag]
+      if not tags:
+        continue
+      lists = sorted([self.positions.get(tag, []) for tag in tags], key=len)
+      group_matched = set(lists[0])
+      for positions in lists[1:]:
+        group_matched.intersection_update(positions)
+      matched.update(group_matched)
+    return sorted(matched)
+
+  def query(self, expr, limit=None, reverse=False):
+    """Returns copies of the resources matching |expr|, newest first.
+
+    Callers localize and rewrite the returned entities in place, so they get
+    shallow copies rather than the shared snapshot entities.
+    """
+    positions = self._match(expr)
+    if reverse:
+      positions = positions[::-1]
+    if limit:
+      positions = positions[:limit]
+    return [copy.copy(self.resources[p]) for p in positions]
+
+
+_tag_index = None
+_tag_index_lock = threading.Lock()
+
+def get_tag_index():
+  """Returns this instance's TagIndex, rebuilt when the generation changes."""
+  global _tag_index
+
+  generation = get_generation()
+  index = _tag_index
+  if index is None or index.generation != generation:
+    with _tag_index_lock:
+      index = _tag_index
+      if index is None or index.generation != generation:
+        # DB query is memcached in get_all().
+        index = TagIndex(generation,
+                         Resource.get_all(order='-publication_date'))
+        _tag_index = index
+  return index
 
 
 class TutorialForm(forms.Form):
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Builds the full-text search index served from /api/search.
+
+Every localized article under content/ (.../<article>/<locale>/index.html) is
+stripped of its Django template syntax, parsed with html5lib, and tokenized
+with the same tokenizer the server uses for queries. The postings and BM25
+statistics for each locale are written out as compact JSON.
+
+Article titles come from the resources in database/, translated with the
+locale's catalog the way the site does. Articles that aren't resources use
+their title block or first heading.
+
+Usage:
+  build_search_index.py
+  build_search_index.py --content=../content --output=../search_index.json
+"""
+
+import collections
+import gettext
+import json
+import optparse
+import os
+import re
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+import yaml
+
+import html5lib
+from html5lib import treebuilders, treewalkers
+
+import search
+
+# The resource files ImportHandler loads into the datastore.
+RESOURCE_FILES = ['tutorials.yaml', 'playground.yaml', 'studio.yaml']
+
+LOCALE_RE = re.compile(r'^[a-z]{2,3}$')
+TITLE_RE = re.compile(
+    r'{%\s*block\s+(?:headtitle|pagetitle)\s*%}(.*?){%\s*endblock', re.S)
+HEADING_RE = re.compile(r'<h[12][^>]*>(.*?)</h[12]\s*>', re.S | re.I)
+CONTENT_RE = re.compile(r'{%\s*block\s+content\s*%}(.*){%\s*endblock', re.S)
+DJANGO_COMMENT_RE = re.compile(
+    r'{%\s*comment\s*%}.*?{%\s*endcomment\s*%}|{#.*?#}', re.S)
+DJANGO_TAG_RE = re.compile(r'{%.*?%}|{{.*?}}', re.S)
+
+SKIPPED_ELEMENTS = frozenset(['script', 'style'])
+
+
+def strip_django(template_text):
+  template_text = DJANGO_COMMENT_RE.sub(' ', template_text)
+  return DJANGO_TAG_RE.sub(' ', template_text)
+
+
+def extract_text(html):
+  """Returns the visible text of an HTML fragment."""
+  parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder('simpletree'),
+                               collectErrors=False)
+  walker = treewalkers.getTreeWalker('simpletree')
+  text = []
+  skip_depth = 0
+  for token in walker(parser.parse(html)):
+    token_type = token['type']
+    if token_type == 'StartTag' and token['name'] in SKIPPED_ELEMENTS:
+      skip_depth += 1
+    elif token_type == 'EndTag' and token['name'] in SKIPPED_ELEMENTS:
+      skip_depth -= 1
+    elif token_type == 'Characters' and not skip_depth:
+      text.append(token['data'])
+  return ' '.join(text)
+
+
+def load_resource_titles(database_dir):
+  """Returns {url: title} for the resources in the database YAML files."""
+  titles = {}
+  for filename in RESOURCE_FILES:
+    f = open(os.path.join(database_dir, filename), 'rb')
+    try:
+      for resource in yaml.load_all(f):
+        if resource and resource.get('url') and resource.get('title'):
+          titles[resource['url']] = unicode(resource['title'])
+    finally:
+      f.close()
+  return titles
+
+
+def load_catalog(locale_dir, locale):
+  """Returns the gettext catalog main.py translates resource strings with."""
+  try:
+    return gettext.translation('django', locale_dir, [locale])
+  except IOError:
+    return gettext.NullTranslations()
+
+
+def find_title(template_text, body):
+  """Returns the title of an article that isn't a resource, or None."""
+  title_match = TITLE_RE.search(template_text)
+  title = title_match and strip_django(title_match.group(1)).strip()
+  if not title:
+    heading_match = HEADING_RE.search(strip_django(body))
+    title = heading_match and extract_text(heading_match.group(1)).strip()
+  return title or None
+
+
+def find_articles(content_dir):
+  """Yields (locale, url without the locale, path) for each article."""
+  for dirpath, dirnames, filenames in os.walk(content_dir):
+    dirnames[:] = [d for d in dirnames if d != 'static']
+    locale = os.path.basename(dirpath)
+    if 'index.html' not in filenames or not LOCALE_RE.match(locale):
+      continue
+    article = os.path.relpath(os.path.dirname(dirpath), content_dir)
+    yield (locale, '/%s/' % article.replace(os.sep, '/'),
+           os.path.join(dirpath, 'index.html'))
+
+
+def build_index(content_dir, database_dir, locale_dir):
+  resource_titles = load_resource_titles(database_dir)
+  catalogs = {}
+  locales = {}
+  for locale, article_url, path in sorted(find_articles(content_dir)):
+    url = '/%s%s' % (locale, article_url)
+    f = open(path, 'rb')
+    try:
+      template_text = f.read().decode('utf-8')
+    finally:
+      f.close()
+
+    content_match = CONTENT_RE.search(template_text)
+    body = content_match and content_match.group(1) or template_text
+
+    title = resource_titles.get(article_url)
+    if title is not None:
+      if locale not in catalogs:
+        catalogs[locale] = load_catalog(locale_dir, locale)
+      title = catalogs[locale].ugettext(
+          title.replace('\r\n', '\n').replace('\r', '\n'))
+    else:
+      title = find_title(template_text, body) or url
+
+    counts = collections.defaultdict(int)
+    for term in search.tokenize(title):
+      counts[term] += search.TITLE_WEIGHT
+    for term in search.tokenize(extract_text(strip_django(body))):
+      counts[term] += 1
+
+    locale_data = locales.setdefault(locale, {'docs': [], 'postings': {}})
+    doc = len(locale_data['docs'])
+    locale_data['docs'].append([url, title, sum(counts.itervalues())])
+    for term, tf in counts.iteritems():
+      locale_data['postings'].setdefault(term, []).extend([doc, tf])
+
+  for locale_data in locales.itervalues():
+    lengths = [length for (url, title, length) in locale_data['docs']]
+    locale_data['avgdl'] = float(sum(lengths)) / max(len(lengths), 1)
+
+  return {'version': search.INDEX_VERSION, 'locales': locales}
+
+
+def main():
+  option_parser = optparse.OptionParser()
+  option_parser.add_option('--content', default=os.path.join(ROOT_DIR, 'content'),
+                           help='Directory containing the articles.')
+  option_parser.add_option('--database',
+                           default=os.path.join(ROOT_DIR, 'database'),
+                           help='Directory containing the resource YAML files.')
+  option_parser.add_option('--locale',
+                           default=os.path.join(ROOT_DIR, 'conf', 'locale'),
+                           help='Directory containing the translation catalogs.')
+  option_parser.add_option('--output',
+                           default=os.path.join(ROOT_DIR, 'search_index.json'),
+                           help='Where to write the index.')
+  options, args = option_parser.parse_args()
+
+  index = build_index(options.content, options.database, options.locale)
+  f = open(options.output, 'wb')
+  try:
+    json.dump(index, f, separators=(',', ':'))
+  finally:
+    f.close()
+
+  for locale, locale_data in sorted(index['locales'].iteritems()):
+    print '%s: %d documents, %d terms' % (locale, len(locale_data['docs']),
+                                          len(locale_data['postings']))
+
+
+if __name__ == '__main__':
+  main()
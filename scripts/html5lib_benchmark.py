@@ -0,0 +1,106 @@
+#!/usr/bin/python
+#
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures html5lib throughput over the article templates under content/.
+
+Usage:
+  html5lib_benchmark.py
+  html5lib_benchmark.py --mode=parse --rounds=10
+  html5lib_benchmark.py --mode=parse-no-errors
+"""
+
+import codecs
+import optparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+import html5lib
+from html5lib import tokenizer, treebuilders
+
+
+def load_corpus(content_dir):
+  """Returns the text of every HTML file under |content_dir|."""
+  docs = []
+  for dirpath, dirnames, filenames in os.walk(content_dir):
+    for filename in sorted(filenames):
+      if filename.endswith('.html'):
+        f = codecs.open(os.path.join(dirpath, filename), encoding='utf-8')
+        try:
+          docs.append(f.read())
+        finally:
+          f.close()
+  return docs
+
+
+def tokenize(docs):
+  for doc in docs:
+    for token in tokenizer.HTMLTokenizer(doc):
+      pass
+
+
+def parse(docs):
+  parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder('simpletree'))
+  for doc in docs:
+    parser.parse(doc)
+
+
+def parse_without_errors(docs):
+  parser = html5lib.HTMLParser(tree=treebuilders.getTreeBuilder('simpletree'),
+                               collectErrors=False)
+  for doc in docs:
+    parser.parse(doc)
+
+
+MODES = {
+  'tokenize': tokenize,
+  'parse': parse,
+  'parse-no-errors': parse_without_errors,
+}
+
+
+def main():
+  option_parser = optparse.OptionParser()
+  option_parser.add_option('--content', default=os.path.join(ROOT_DIR, 'content'),
+                           help='Directory containing the documents.')
+  option_parser.add_option('--mode', default='tokenize',
+                           help='One of %s.' % ', '.join(sorted(MODES)))
+  option_parser.add_option('--rounds', type='int', default=5,
+                           help='Times to go through the corpus. The fastest '
+                                'round is reported.')
+  options, args = option_parser.parse_args()
+
+  docs = load_corpus(options.content)
+  size = sum(len(doc.encode('utf-8')) for doc in docs) / 1e6
+  run = MODES[options.mode]
+
+  best = None
+  for i in xrange(options.rounds):
+    start = time.time()
+    run(docs)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+
+  print '%s: %d documents, %.2f MB in %.2f s, %.2f MB/s' % (
+      options.mode, len(docs), size, best, size / best)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures query latency against a search index built by build_search_index.py.
+
+Usage:
+  search_benchmark.py
+  search_benchmark.py --index=../search_index.json --queries=queries.txt
+
+A query file holds one query per line, optionally prefixed by a locale and a
+tab (e.g. "ja<TAB>webgl").
+"""
+
+import optparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+import search
+
+DEFAULT_QUERIES = [
+  ('en', u'webgl'),
+  ('en', u'web workers'),
+  ('en', u'indexeddb offline storage'),
+  ('en', u'canvas performance'),
+  ('en', u'css3 transitions animations'),
+  ('en', u'getusermedia camera'),
+  ('en', u'application cache manifest'),
+  ('en', u'drag and drop files'),
+  ('en', u'web audio api'),
+  ('en', u'requestanimationframe'),
+  ('en', u'websockets server push'),
+  ('en', u'touch events mobile'),
+  ('de', u'webgl'),
+  ('ja', u'キャンバス'),
+  ('zh', u'离线'),
+  ('ru', u'хранилище'),
+]
+
+
+def load_queries(path):
+  queries = []
+  f = open(path, 'rb')
+  try:
+    for line in f:
+      line = line.decode('utf-8').strip()
+      if not line:
+        continue
+      if '\t' in line:
+        locale, text = line.split('\t', 1)
+      else:
+        locale, text = 'en', line
+      queries.append((locale, text))
+  finally:
+    f.close()
+  return queries
+
+
+def percentile(sorted_values, fraction):
+  return sorted_values[min(int(len(sorted_values) * fraction),
+                           len(sorted_values) - 1)]
+
+
+def main():
+  option_parser = optparse.OptionParser()
+  option_parser.add_option('--index',
+                           default=os.path.join(ROOT_DIR, 'search_index.json'))
+  option_parser.add_option('--queries', help='File with one query per line.')
+  option_parser.add_option('--rounds', type='int', default=50,
+                           help='Times to run the whole query set.')
+  options, args = option_parser.parse_args()
+
+  start = time.time()
+  index = search.SearchIndex.load(options.index)
+  print 'Loaded index in %.1f ms' % ((time.time() - start) * 1000)
+
+  queries = options.queries and load_queries(options.queries) or DEFAULT_QUERIES
+
+  timings = []
+  for i in xrange(options.rounds):
+    for locale, text in queries:
+      start = time.time()
+      index.query(text, locale)
+      timings.append((time.time() - start) * 1000)
+  timings.sort()
+
+  print '%d queries: mean %.3f ms, p50 %.3f ms, p95 %.3f ms, max %.3f ms' % (
+      len(timings), sum(timings) / len(timings), percentile(timings, 0.5),
+      percentile(timings, 0.95), timings[-1])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares ways of serving the {% toc %} markup of large tables of contents.
+
+Usage:
+  toc_benchmark.py
+  toc_benchmark.py --entries=5000 --rounds=20
+"""
+
+import optparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from customtags.toc import render_toc
+
+
+def render_toc_concat(toc):
+  """How TOCNode used to build the markup on every render."""
+  output = ''
+  level = 0
+  for entry in toc:
+    if entry['level'] > level:
+      output += "<ul>"
+    elif entry['level'] < level:
+      output += "</ul></li>" * (level - entry['level'])
+    else:
+      output += "</li>"
+    level = entry['level']
+    output += "<li><a href='#%s' onclick='$.scrollTo(\"#%s\", 800, {offset: {top: -35}})'>%s</a>" % (entry['id'], entry['id'], entry.get('text', ''))
+
+  output += "</li></ul>" * level
+  return output
+
+
+def make_toc(num_entries):
+  """Returns a TOC cycling through h2, h3 and h4 headings."""
+  return [{'level': 1 + i % 3, 'id': 'toc-section-%d' % i,
+           'text': 'Section %d' % i} for i in xrange(num_entries)]
+
+
+def timeit(func, rounds):
+  start = time.time()
+  for i in xrange(rounds):
+    func()
+  return (time.time() - start) * 1000 / rounds
+
+
+def main():
+  option_parser = optparse.OptionParser()
+  option_parser.add_option('--entries', type='int', default=2000,
+                           help='Number of headings in the TOC.')
+  option_parser.add_option('--rounds', type='int', default=50)
+  options, args = option_parser.parse_args()
+
+  toc = make_toc(options.entries)
+  prebuilt = {'entries': toc, 'html': render_toc(toc)}
+  assert prebuilt['html'] == render_toc_concat(toc)
+
+  print '%d entries, %d bytes of markup' % (len(toc), len(prebuilt['html']))
+  print 'concatenation per render: %.3f ms' % timeit(
+      lambda: render_toc_concat(toc), options.rounds)
+  print 'join per render:          %.3f ms' % timeit(
+      lambda: render_toc(toc), options.rounds)
+  print 'prebuilt:                 %.3f ms' % timeit(
+      lambda: prebuilt['html'], options.rounds)
+
+
+if __name__ == '__main__':
+  main()
@@ -35,6 +35,7 @@ do
 done
 
 ./compress_js_css.sh
+python ./build_search_index.py
 # Cache busting is handled by the GAE PageSpeed feature generating unique URLs.
 #./cachebust.py
 echo \# `date` >> ../cache.appcache
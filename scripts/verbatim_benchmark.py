@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times parsing a {% verbatim %} block holding thousands of tokens.
+
+Needs the Django version the app runs with on the path, e.g. the one bundled
+with the App Engine SDK.
+
+Usage:
+  verbatim_benchmark.py
+  verbatim_benchmark.py --tokens=20000
+"""
+
+import optparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from django import template
+
+from customtags.parsing import consume_verbatim
+
+
+def consume_verbatim_pop(tokens):
+  """How the verbatim tag used to consume its tokens."""
+  text = []
+  while 1:
+    token = tokens.pop(0)
+    if token.contents == 'endverbatim':
+      break
+    if token.token_type == template.TOKEN_VAR:
+      text.append('{{')
+    elif token.token_type == template.TOKEN_BLOCK:
+      text.append('{%')
+    text.append(token.contents)
+    if token.token_type == template.TOKEN_VAR:
+      text.append('}}')
+    elif token.token_type == template.TOKEN_BLOCK:
+      text.append('%}')
+  return ''.join(text)
+
+
+def make_tokens(num_tokens):
+  """Returns the tokens of a jQuery template block and the rest of a page."""
+  kinds = [(template.TOKEN_TEXT, '<li class="item">'),
+           (template.TOKEN_VAR, 'if done'),
+           (template.TOKEN_TEXT, '<s>'),
+           (template.TOKEN_VAR, '/if'),
+           (template.TOKEN_VAR, 'name'),
+           (template.TOKEN_TEXT, '</li>\n')]
+  tokens = [template.Token(*kinds[i % len(kinds)]) for i in xrange(num_tokens)]
+  tokens.append(template.Token(template.TOKEN_BLOCK, 'endverbatim'))
+  # What the parser still has to go through after the block.
+  tokens.extend(template.Token(template.TOKEN_TEXT, '<p>')
+                for i in xrange(num_tokens))
+  return tokens
+
+
+def timeit(func, num_tokens, rounds):
+  total = 0
+  for i in xrange(rounds):
+    tokens = make_tokens(num_tokens)
+    start = time.time()
+    text = func(tokens)
+    total += time.time() - start
+  return text, total * 1000 / rounds
+
+
+def main():
+  option_parser = optparse.OptionParser()
+  option_parser.add_option('--tokens', type='int', default=5000,
+                           help='Number of tokens inside the block.')
+  option_parser.add_option('--rounds', type='int', default=10)
+  options, args = option_parser.parse_args()
+
+  old_text, old_time = timeit(consume_verbatim_pop, options.tokens,
+                              options.rounds)
+  new_text, new_time = timeit(consume_verbatim, options.tokens, options.rounds)
+  assert old_text == new_text
+
+  print '%d tokens: pop(0) %.2f ms, single pass %.2f ms' % (
+      options.tokens, old_time, new_time)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Local full-text search over the site's articles.
+
+The index is built offline by scripts/build_search_index.py and loaded once per
+instance. It is a JSON document of the form:
+
+  {'version': 1,
+   'locales': {
+     'en': {'docs': [[url, title, length], ...],
+            'avgdl': 812.4,
+            'postings': {term: [doc, tf, doc, tf, ...], ...}},
+     ...}}
+
+Queries are ranked with Okapi BM25.
+"""
+
+import heapq
+import json
+import math
+import re
+import threading
+
+INDEX_VERSION = 1
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+# How much more a title token counts than a body token.
+TITLE_WEIGHT = 3
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Han, Hiragana, Katakana and Hangul are written without spaces between words,
+# so runs of them are indexed as overlapping character bigrams instead.
+_CJK_RE = re.compile(u'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff'
+                     u'\uac00-\ud7af\uf900-\ufaff]+)')
+
+
+def tokenize(text):
+  """Splits |text| into lowercase search terms."""
+  terms = []
+  for chunk in _CJK_RE.split(text.lower()):
+    if not chunk:
+      continue
+    if _CJK_RE.match(chunk):
+      if len(chunk) == 1:
+        terms.append(chunk)
+      else:
+        terms.extend(chunk[i:i + 2] for i in xrange(len(chunk) - 1))
+    else:
+      terms.extend(_WORD_RE.findall(chunk))
+  return terms
+
+
+class LocaleIndex(object):
+  """BM25 index of the documents of a single locale."""
+
+  def __init__(self, data):
+    self.docs = data['docs']
+    self.postings = data['postings']
+    avgdl = data['avgdl'] or 1.0
+
+    # The length normalization part of the BM25 denominator only depends on
+    # the document, so compute it once per document up front.
+    self.norms = [K1 * (1 - B + B * length / avgdl)
+                  for (url, title, length) in self.docs]
+
+  def query(self, text, limit=10):
+    """Returns up to |limit| (score, url, title) tuples, best first."""
+    num_docs = len(self.docs)
+    scores = {}
+    for term in set(tokenize(text)):
+      postings = self.postings.get(term)
+      if not postings:
+        continue
+      df = len(postings) / 2
+      idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+      norms = self.norms
+      for i in xrange(0, len(postings), 2):
+        doc, tf = postings[i], postings[i + 1]
+        scores[doc] = (scores.get(doc, 0.0) +
+                       idf * tf * (K1 + 1) / (tf + norms[doc]))
+
+    best = heapq.nlargest(limit, scores.iteritems(), key=lambda item: item[1])
+    return [(score, self.docs[doc][0], self.docs[doc][1])
+            for (doc, score) in best]
+
+
+class SearchIndex(object):
+  """Per-locale BM25 indexes loaded from a file written by the indexer."""
+
+  def __init__(self, data):
+    if data.get('version') != INDEX_VERSION:
+      raise ValueError('Unsupported search index version %r' %
+                       data.get('version'))
+    self.locales = dict((locale, LocaleIndex(locale_data))
+                        for (locale, locale_data)
+                        in data['locales'].iteritems())
+
+  @classmethod
+  def load(cls, path):
+    f = open(path, 'rb')
+    try:
+      return cls(json.load(f))
+    finally:
+      f.close()
+
+  def query(self, text, locale, default_locale='en', limit=10):
+    """Searches |locale|, falling back to |default_locale|."""
+    index = self.locales.get(locale) or self.locales.get(default_locale)
+    if index is None:
+      return []
+    return index.query(text, limit=limit)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index(path):
+  """Returns the instance-wide SearchIndex, loading it from |path| on first use.
+
+  Returns None if the index file has not been built.
+  """
+  global _index
+
+  if _index is None:
+    with _index_lock:
+      if _index is None:
+        try:
+          _index = SearchIndex.load(path)
+        except IOError:
+          return None
+  return _index
@@ -36,6 +36,9 @@ APP_VERSION = os.environ['CURRENT_VERSION_ID'].split('.')[0]
 MEMCACHE_KEY_PREFIX = 'newscheme' #APP_VERSION
 MAX_FETCH_LIMIT = 1000
 
+# Built by scripts/build_search_index.py, served by /api/search.
+SEARCH_INDEX_PATH = os.path.join(ROOT_DIR, 'search_index.json')
+
 # Users whitelisted to access certain sections the site.
 WHITELISTED_USERS = [
   'chrome.devrel@gmail.com'